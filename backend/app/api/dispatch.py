@@ -0,0 +1,141 @@
+"""
+扫描任务调度：专用的有界线程池 + 准入控制 + 单请求截止时间
+
+- 扫描（读链 + 预处理 + 枚举价差）在独立的 SCAN_WORKERS 线程池中运行，不占用 Starlette 的默认线程池
+- 在途（排队 + 执行中）任务数达到 SCAN_QUEUE_LIMIT 时直接返回 503 + Retry-After，而不是继续排队拖垮 p99
+- 超过 SCAN_DEADLINE_S 返回 504：仍在排队的任务被取消；已开始执行的线程无法中断，
+  但会一直计入在途数直到真正结束，准入控制不会低估负载
+- 相同的在途请求（路由 + 规范化请求体 + 快照 asof_ts）合并为一次计算，结果与阶段耗时分发给所有等待者
+
+使用线程池而不是进程池：扫描依赖进程内的链缓存 / 预处理缓存，numpy 内核大部分时间释放 GIL；
+多核扩展由 uvicorn 的多 worker 进程提供。
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from ..services.catalog import get_catalog
+from ..services.metrics import add_request_stages, begin_request_stages
+
+
+SCAN_WORKERS = int(os.environ.get("SCAN_WORKERS", min(4, os.cpu_count() or 1)))
+SCAN_QUEUE_LIMIT = int(os.environ.get("SCAN_QUEUE_LIMIT", 32))
+SCAN_DEADLINE_S = float(os.environ.get("SCAN_DEADLINE_S", 10))
+SCAN_RETRY_AFTER_S = int(os.environ.get("SCAN_RETRY_AFTER_S", 1))
+
+
+class ScanDispatcher:
+    """有界扫描执行器：在途任务数上限 + 截止时间"""
+
+    def __init__(self, workers: int, queue_limit: int, deadline_s: float):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.deadline_s = deadline_s
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """在扫描线程池中执行 fn；饱和时抛 503，超时抛 504"""
+        with self._lock:
+            if self._in_flight >= self.queue_limit:
+                raise HTTPException(
+                    status_code=503,
+                    detail="scan capacity exhausted, retry later",
+                    headers={"Retry-After": str(SCAN_RETRY_AFTER_S)},
+                )
+            self._in_flight += 1
+        try:
+            # 在调用方上下文的副本中执行：请求级 contextvar（阶段耗时等）在线程内可见
+            cf = self._executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        except BaseException:
+            self._release(None)
+            raise
+        cf.add_done_callback(self._release)
+
+        try:
+            # wait_for 超时会取消包装的 future，并把取消传递给仍在排队的 concurrent future
+            return await asyncio.wait_for(asyncio.wrap_future(cf), self.deadline_s)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="scan deadline exceeded")
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_dispatcher = ScanDispatcher(SCAN_WORKERS, SCAN_QUEUE_LIMIT, SCAN_DEADLINE_S)
+
+
+def get_dispatcher() -> ScanDispatcher:
+    return _dispatcher
+
+
+async def run_scan(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return await _dispatcher.run(fn, *args, **kwargs)
+
+
+class SingleFlight:
+    """在途请求合并：同一个 key 同时只有一个计算任务，所有调用方等待同一结果（或同一异常）"""
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._tasks
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+        # shield：某个等待者被取消时，共享任务继续为其他等待者运行
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # 所有等待者都已离开时避免 "exception was never retrieved"
+
+
+_single_flight = SingleFlight()
+
+
+async def run_scan_coalesced(route: str, req: BaseModel, date: Optional[str], fn: Callable[[Any], Any]) -> Any:
+    """以 (route, 规范化请求体, 快照 asof_ts) 合并相同的在途扫描；date 为 None 表示最新快照"""
+    key = (route, req.json(sort_keys=True), get_catalog().snapshot_asof(date))
+    joined = key in _single_flight
+    t0 = time.perf_counter()
+    result, stages = await _single_flight.do(key, lambda: _run_with_stages(fn, req))
+    # 每个调用方（包括发起者）都计入这次共享计算的阶段耗时；后加入者另记等待时间
+    add_request_stages(stages)
+    if joined:
+        add_request_stages({"coalesced": time.perf_counter() - t0})
+    return result
+
+
+async def _run_with_stages(fn: Callable[[Any], Any], req: BaseModel):
+    # 共享任务运行在发起者上下文的副本中，这里为它单独收集阶段耗时
+    stages = begin_request_stages()
+    return await run_scan(fn, req), stages
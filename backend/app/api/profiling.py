@@ -0,0 +1,75 @@
+"""
+按需性能剖析：请求头 X-Profile-Token 与环境变量 SPREAD_PROFILE_TOKEN 一致时启用
+
+- 在扫描线程内用 cProfile 包裹扫描与序列化（只剖析该线程），绕过响应缓存与请求合并，保证真实计算
+- .prof 文件写入 SPREAD_PROFILE_DIR（可用 snakeviz / pstats 打开），
+  响应体为 {"profile": {file, wall_ms, top}, "result": 原始结果}，top 为自身耗时最高的函数
+- 未设置 SPREAD_PROFILE_TOKEN 时该功能关闭
+"""
+from __future__ import annotations
+
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+from .dispatch import run_scan
+
+
+PROFILE_TOKEN = os.environ.get("SPREAD_PROFILE_TOKEN", "")
+PROFILE_DIR = Path(os.environ.get("SPREAD_PROFILE_DIR", Path(tempfile.gettempdir()) / "spread-finder-profiles"))
+PROFILE_TOP_N = int(os.environ.get("SPREAD_PROFILE_TOP_N", 25))
+PROFILE_HEADER = "x-profile-token"
+
+
+def profile_requested(request: Request) -> bool:
+    token = request.headers.get(PROFILE_HEADER)
+    # 按字节比较：compare_digest 对含非 ASCII 字符的 str 会抛 TypeError
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+def _top_functions(profiler: cProfile.Profile, n: int) -> List[Dict]:
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda kv: kv[1][2], reverse=True)[:n]
+    return [
+        {
+            "function": f"{Path(file).name}:{line}({func})",
+            "calls": nc,
+            "tottime_ms": round(tt * 1000, 3),
+            "cumtime_ms": round(ct * 1000, 3),
+        }
+        for (file, line, func), (_cc, nc, tt, ct, _callers) in rows
+    ]
+
+
+def _profiled(route: str, render: Callable[[BaseModel], bytes], req: BaseModel) -> bytes:
+    profiler = cProfile.Profile()
+    t0 = time.perf_counter()
+    profiler.enable()
+    try:
+        body = render(req)
+    finally:
+        profiler.disable()
+    wall_ms = (time.perf_counter() - t0) * 1000
+
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    path = PROFILE_DIR / f"{route.replace('/', '_')}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{time.perf_counter_ns()}.prof"
+    profiler.dump_stats(str(path))
+    profile = {"file": str(path), "wall_ms": round(wall_ms, 3), "top": _top_functions(profiler, PROFILE_TOP_N)}
+    # 原始结果已按 FastAPI 默认方式序列化，直接拼接避免二次编码
+    return b'{"profile":' + json.dumps(profile).encode() + b',"result":' + body + b"}"
+
+
+async def run_profiled(route: str, req: BaseModel, render: Callable[[BaseModel], bytes]) -> Response:
+    """render: 计算并序列化一个请求（在扫描线程中执行）"""
+    body = await run_scan(_profiled, route, render, req)
+    return Response(content=body, media_type="application/json", headers={"Cache-Control": "no-store"})
+
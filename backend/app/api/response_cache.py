@@ -0,0 +1,213 @@
+"""
+扫描结果响应缓存：结果只取决于 (路由, 请求参数, 快照 asof_ts)
+
+- 以 (路由, 规范化请求体, asof_ts) 缓存序列化后的 JSON 字节，LRU + 字节上限
+- ETag 由 asof_ts 与参数摘要构成，If-None-Match 命中时直接返回 304，不做任何计算。
+  扫描接口用 POST 只是为了携带请求体，语义上是无副作用的只读查询，因此按 GET 的条件请求处理
+  （RFC 9110 §13.1.2 只为 GET/HEAD 定义 304）；只认具体的 ETag，不支持 If-None-Match: *
+- Cache-Control max-age 为距下一个快照时间槽（默认整点 ETL）的秒数；
+  当前时间槽的快照尚未落地时只给短 max-age，避免代理在新快照发布后继续提供旧结果
+- 未命中时在扫描线程池中完成计算与序列化（经 dispatch 的请求合并与准入控制）；计算期间若发布了新快照，
+  无法确定结果属于哪个快照，此时不缓存、不带 ETag
+- 记录针对最新快照的请求形状频率（指数衰减），供后台预热选择要预计算的请求
+- 带管理员剖析头的请求绕过缓存，交给 profiling 模块（见 profiling.py）
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from ..services.catalog import get_catalog
+from ..services.metrics import record_cache, timed_stage
+from .dispatch import run_scan_coalesced
+from .profiling import profile_requested, run_profiled
+
+
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("SPREAD_RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# 快照发布周期与相位（整点 cron：3600 / 0）；实时 ingest 部署可设为其 checkpoint 间隔
+SNAPSHOT_INTERVAL_S = int(os.environ.get("SNAPSHOT_INTERVAL_S", 3600))
+SNAPSHOT_OFFSET_S = int(os.environ.get("SNAPSHOT_OFFSET_S", 0))
+# 当前时间槽的快照还没发布（ETL 进行中或失败）时的 max-age
+RESPONSE_STALE_MAX_AGE_S = int(os.environ.get("SPREAD_RESPONSE_STALE_MAX_AGE_S", 30))
+REQUEST_STATS_MAX_SHAPES = int(os.environ.get("SPREAD_REQUEST_STATS_MAX_SHAPES", 256))
+REQUEST_STATS_HALF_LIFE_S = float(os.environ.get("SPREAD_REQUEST_STATS_HALF_LIFE_S", 6 * 3600))
+
+
+class _ResponseCache:
+    """序列化响应体的 LRU 缓存（按字节数限制）"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key: Tuple, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+_response_cache = _ResponseCache(RESPONSE_CACHE_MAX_BYTES)
+
+
+def clear_response_cache() -> None:
+    _response_cache.clear()
+
+
+class RequestStats:
+    """请求形状（路由 + 除 date 外的参数）的频率统计，计数按半衰期指数衰减，只保留最多 max_shapes 个形状"""
+
+    def __init__(self, max_shapes: int, half_life_s: float):
+        self.max_shapes = max_shapes
+        self.half_life_s = half_life_s
+        self._counts: Dict[Tuple[str, str], float] = {}
+        self._shapes: Dict[Tuple[str, str], Tuple[Type[BaseModel], Callable[[Any], Any], Dict]] = {}
+        self._lock = threading.Lock()
+        self._decayed_at = time.monotonic()
+
+    def record(self, route: str, req: BaseModel, fn: Callable[[Any], Any]) -> None:
+        params = req.dict()
+        params.pop("date", None)
+        key = (route, json.dumps(params, sort_keys=True))
+        with self._lock:
+            self._decay()
+            if key not in self._counts:
+                if len(self._counts) >= self.max_shapes:
+                    coldest = min(self._counts, key=self._counts.__getitem__)
+                    del self._counts[coldest], self._shapes[coldest]
+                self._shapes[key] = (type(req), fn, params)
+            self._counts[key] = self._counts.get(key, 0.0) + 1.0
+
+    def _decay(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._decayed_at
+        if elapsed < 60:
+            return
+        factor = 0.5 ** (elapsed / self.half_life_s)
+        for key in self._counts:
+            self._counts[key] *= factor
+        self._decayed_at = now
+
+    def top(self, n: int) -> List[Tuple[str, Type[BaseModel], Callable[[Any], Any], Dict]]:
+        """按衰减后的频率降序返回最多 n 个形状：(route, 请求模型, 扫描函数, 除 date 外的参数)"""
+        with self._lock:
+            keys = sorted(self._counts, key=self._counts.__getitem__, reverse=True)[:n]
+            return [(key[0], *self._shapes[key]) for key in keys]
+
+
+_request_stats = RequestStats(REQUEST_STATS_MAX_SHAPES, REQUEST_STATS_HALF_LIFE_S)
+
+
+def get_request_stats() -> RequestStats:
+    return _request_stats
+
+
+def make_etag(route: str, params: str, asof: int) -> str:
+    digest = hashlib.sha1(f"{route}\n{params}".encode()).hexdigest()[:16]
+    return f'"{asof}-{digest}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    # If-None-Match 使用弱比较；"*" 对非 GET/HEAD 请求应返回 412，只读 POST 不予处理
+    return any(c.removeprefix("W/") == etag for c in candidates)
+
+
+def max_age_for(asof: int, historical: bool, now: Optional[float] = None) -> int:
+    """距下一个快照时间槽的秒数；当前时间槽的快照尚未落地时返回短 max-age"""
+    if historical:
+        return SNAPSHOT_INTERVAL_S
+    now = time.time() if now is None else now
+    slot_start = now - (now - SNAPSHOT_OFFSET_S) % SNAPSHOT_INTERVAL_S
+    if asof / 1000 < slot_start:
+        return RESPONSE_STALE_MAX_AGE_S
+    return max(1, int(slot_start + SNAPSHOT_INTERVAL_S - now))
+
+
+def _render(fn: Callable[[Any], Any], req: BaseModel) -> bytes:
+    result = fn(req)
+    # 与 FastAPI 默认的序列化一致：jsonable_encoder + JSONResponse
+    with timed_stage("serialize"):
+        return JSONResponse(content=jsonable_encoder(result)).body
+
+
+def prime(route: str, req: BaseModel, date: Optional[str], fn: Callable[[Any], Any]) -> bool:
+    """同步预计算一个请求并写入响应缓存（预热用）；已缓存或没有快照时返回 False"""
+    asof = get_catalog().snapshot_asof(date)
+    if asof is None:
+        return False
+    key = (route, req.json(sort_keys=True), asof)
+    if _response_cache.get(key) is not None:
+        return False
+    body = _render(fn, req)
+    if get_catalog().snapshot_asof(date) != asof:
+        return False
+    _response_cache.put(key, body)
+    return True
+
+
+async def cached_scan(request: Request, route: str, req: BaseModel, date: Optional[str], fn: Callable[[Any], Any]) -> Response:
+    """带 ETag / 304 / Cache-Control 的扫描响应；date 为 None 表示最新快照"""
+    if profile_requested(request):
+        return await run_profiled(route, req, lambda r: _render(fn, r))
+
+    catalog = get_catalog()
+    asof = catalog.snapshot_asof(date)
+    params = req.json(sort_keys=True)
+    if asof is None:
+        # 没有快照：交给扫描函数返回 404，不缓存
+        body = await run_scan_coalesced(route, req, date, lambda r: _render(fn, r))
+        return Response(content=body, media_type="application/json")
+
+    etag = make_etag(route, params, asof)
+    historical = date is not None and date != catalog.latest_date()
+    if not historical:
+        _request_stats.record(route, req, fn)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age_for(asof, historical)}"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        record_cache("response", True)
+        return Response(status_code=304, headers=headers)
+
+    key = (route, params, asof)
+    body = _response_cache.get(key)
+    record_cache("response", body is not None)
+    if body is None:
+        body = await run_scan_coalesced(route, req, date, lambda r: _render(fn, r))
+        if catalog.snapshot_asof(date) != asof:
+            # 计算期间快照已切换：结果可能来自新快照，不能按旧 asof 缓存或给出 ETag
+            return Response(content=body, media_type="application/json", headers={"Cache-Control": "no-cache"})
+        _response_cache.put(key, body)
+    return Response(content=body, media_type="application/json", headers=headers)
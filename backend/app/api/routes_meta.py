@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from fastapi import APIRouter, HTTPException, Query
 
-from ..services.loader import list_available_dates, list_expiries_for, get_manifest
+from ..services.catalog import get_catalog
 
 
 router = APIRouter()
@@ -10,7 +10,7 @@ router = APIRouter()
 
 @router.get("/meta/dates")
 def get_dates():
-    return {"dates": list_available_dates()}
+    return {"dates": get_catalog().dates()}
 
 
 @router.get("/expiries")
@@ -19,7 +19,7 @@ def get_expiries(
     date: str = Query(..., description="YYYY-MM-DD"),
 ):
     try:
-        expiries = list_expiries_for(date=date, base=base)
+        expiries = get_catalog().expiries(date=date, base=base)
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="date/base not found")
     return {"date": date, "base": base, "expiries": expiries}
@@ -31,7 +31,7 @@ def get_asof(
     date: str = Query(..., description="YYYY-MM-DD"),
 ):
     try:
-        manifest = get_manifest(date=date)
+        manifest = get_catalog().manifest(date=date)
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="manifest not found for date")
 
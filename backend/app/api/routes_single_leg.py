@@ -3,11 +3,12 @@
 """
 from __future__ import annotations
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel, Field
 
 from ..services.loader import load_chain_for, get_latest_date
 from ..services.single_leg import scan_csp, scan_cc
+from .response_cache import cached_scan
 
 
 class CSPRequest(BaseModel):
@@ -36,7 +37,7 @@ router = APIRouter()
 
 
 @router.post("/strategy/csp")
-def scan_csp_strategy(req: CSPRequest):
+async def scan_csp_strategy(req: CSPRequest, request: Request):
     """
     扫描 CSP（Cash Secured Put）策略
 
@@ -45,9 +46,13 @@ def scan_csp_strategy(req: CSPRequest):
     - 需要现金保证金支持
     - 适合看涨或中性市场
     """
+    return await cached_scan(request, "strategy/csp", req, None, _scan_csp_strategy)
+
+
+def _scan_csp_strategy(req: CSPRequest):
     try:
         latest_date = get_latest_date()
-        chain, meta = load_chain_for(date=latest_date, base=req.base)
+        chain, meta = load_chain_for(date=latest_date, base=req.base, dte_range=(0, req.max_dte), option_type="P")
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="数据不可用")
 
@@ -65,7 +70,7 @@ def scan_csp_strategy(req: CSPRequest):
 
 
 @router.post("/strategy/cc")
-def scan_cc_strategy(req: CCRequest):
+async def scan_cc_strategy(req: CCRequest, request: Request):
     """
     扫描 CC（Covered Call）策略
 
@@ -74,9 +79,13 @@ def scan_cc_strategy(req: CCRequest):
     - 获取额外权利金收益
     - 适合震荡或温和上涨市场
     """
+    return await cached_scan(request, "strategy/cc", req, None, _scan_cc_strategy)
+
+
+def _scan_cc_strategy(req: CCRequest):
     try:
         latest_date = get_latest_date()
-        chain, meta = load_chain_for(date=latest_date, base=req.base)
+        chain, meta = load_chain_for(date=latest_date, base=req.base, dte_range=(0, req.max_dte), option_type="C")
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="数据不可用")
 
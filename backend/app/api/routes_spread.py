@@ -1,10 +1,11 @@
 from __future__ import annotations
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel, Field
 
 from ..services.loader import load_chain_for, get_latest_date
-from ..services.scanner import scan_buckets, scan_opinion_spreads
+from ..services.scanner import horizon_window, scan_buckets, scan_opinion_spreads, tenor_window
+from .response_cache import cached_scan
 
 
 class ScanRequest(BaseModel):
@@ -30,9 +31,19 @@ router = APIRouter()
 
 
 @router.post("/spread/scan")
-def scan(req: ScanRequest):
+async def scan(req: ScanRequest, request: Request):
+    return await cached_scan(request, "spread/scan", req, req.date, _scan)
+
+
+def _scan(req: ScanRequest):
     try:
-        chain, meta = load_chain_for(date=req.date, base=req.base)
+        # direction 只保留 CALL（up）或 PUT（down）的结果，只需读取对应类型
+        chain, meta = load_chain_for(
+            date=req.date,
+            base=req.base,
+            dte_range=tenor_window(req.tenor),
+            option_type="C" if req.direction == "up" else "P",
+        )
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="data not found for date/base")
 
@@ -49,16 +60,25 @@ def scan(req: ScanRequest):
 
 
 @router.post("/spread/opinion")
-def opinion(req: OpinionRequest):
+async def opinion(req: OpinionRequest, request: Request):
     """
     根据用户观点（目标价 + 时间范围）筛选最优价差策略
     - up/down: 借方价差（付权利金）
     - not_up/not_down: 贷方价差（收权利金）
     """
+    return await cached_scan(request, "spread/opinion", req, None, _opinion)
+
+
+def _opinion(req: OpinionRequest):
     try:
         # 使用最新日期的数据
         latest_date = get_latest_date()
-        chain, meta = load_chain_for(date=latest_date, base=req.base)
+        chain, meta = load_chain_for(
+            date=latest_date,
+            base=req.base,
+            dte_range=horizon_window(req.horizon),
+            option_type="C" if req.view in ("up", "not_up") else "P",
+        )
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="data not found")
 
@@ -0,0 +1,217 @@
+"""
+启动预热：每个 worker 启动后预加载最新快照并预计算默认扫描，预热完成前 /api/ready 返回 503
+
+- 预计算前端默认发出的请求（各标的 × tenor × direction 的到期扫描、默认参数的 CSP / CC），写入响应缓存；
+  链缓存与预处理缓存随之按线上请求实际使用的键填充
+- 预热在后台进行，/api/health 仍然只表示进程存活；滚动重启时负载均衡应以 /api/ready 为准
+- 预热失败只记录错误并标记就绪：冷请求依然可以正常计算，不应让 worker 永远不接流量
+
+之后后台持续运行 warmer：每 WARMER_POLL_S 秒检查 LATEST 指针 / catalog，发现新快照时预计算
+最近请求频率最高的 WARMER_TOP_SHAPES 个请求形状 + 默认请求。为不挤占线上请求：
+一次只提交一个任务、先等扫描线程池空闲（持续有流量时最多等 WARMER_IDLE_MAX_WAIT_S 秒后照常提交，
+否则新快照永远得不到预热），每个快照累计 CPU 时间不超过 WARMER_CPU_BUDGET_S。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from ..services.catalog import get_catalog
+from .dispatch import get_dispatcher, run_scan
+from .response_cache import get_request_stats, prime
+from .routes_single_leg import CCRequest, CSPRequest, _scan_cc_strategy, _scan_csp_strategy
+from .routes_spread import ScanRequest, _scan
+
+
+WARMUP_ENABLED = os.environ.get("SPREAD_WARMUP_ENABLED", "1") not in ("0", "false", "False")
+WARMER_POLL_S = float(os.environ.get("SPREAD_WARMER_POLL_S", 5))
+WARMER_TOP_SHAPES = int(os.environ.get("SPREAD_WARMER_TOP_SHAPES", 32))
+WARMER_CPU_BUDGET_S = float(os.environ.get("SPREAD_WARMER_CPU_BUDGET_S", 20))
+WARMER_IDLE_POLL_S = float(os.environ.get("SPREAD_WARMER_IDLE_POLL_S", 0.2))
+WARMER_IDLE_MAX_WAIT_S = float(os.environ.get("SPREAD_WARMER_IDLE_MAX_WAIT_S", 5))
+
+# 前端默认参数（frontend/components/CSPScanner.tsx / CCScanner.tsx）
+DEFAULT_CSP_CASH = 120000
+SCAN_TENORS = ("near", "mid", "far")
+SCAN_DIRECTIONS = ("up", "down")
+
+WarmJob = Tuple[str, BaseModel, Optional[str], Callable[[Any], Any]]
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupStatus:
+    """预热状态（每个 worker 进程一份）"""
+
+    def __init__(self):
+        self.ready = False
+        self.asof_ts: Optional[int] = None
+        self.primed = 0
+        self.duration_s: Optional[float] = None
+        self.error: Optional[str] = None
+        # 后台 warmer 最近一次预热的快照
+        self.warmed_asof_ts: Optional[int] = None
+        self.warmed_primed = 0
+        self.warmed_cpu_s = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "status": "ready" if self.ready else "warming",
+            "asof_ts": self.asof_ts,
+            "primed": self.primed,
+            "duration_s": self.duration_s,
+            "error": self.error,
+            "warmed_asof_ts": self.warmed_asof_ts,
+            "warmed_primed": self.warmed_primed,
+            "warmed_cpu_s": self.warmed_cpu_s,
+        }
+
+
+_status = WarmupStatus()
+
+
+def get_warmup_status() -> WarmupStatus:
+    return _status
+
+
+def default_jobs(date: str, bases: List[str]) -> List[WarmJob]:
+    """前端默认发出的请求：首页加载的 mid/up 探测、到期扫描的 up+down、默认 CSP / CC"""
+    jobs: List[WarmJob] = []
+    for base in bases:
+        jobs.append(("spread/scan", ScanRequest(base=base, date=date, direction="up", tenor="mid", return_per_bucket=1), date, _scan))
+        for tenor in SCAN_TENORS:
+            for direction in SCAN_DIRECTIONS:
+                req = ScanRequest(base=base, date=date, direction=direction, tenor=tenor, return_per_bucket=10)
+                jobs.append(("spread/scan", req, date, _scan))
+        jobs.append(("strategy/csp", CSPRequest(base=base, available_cash=DEFAULT_CSP_CASH), None, _scan_csp_strategy))
+        jobs.append(("strategy/cc", CCRequest(base=base), None, _scan_cc_strategy))
+    return jobs
+
+
+def popular_jobs(date: str, n: int) -> List[WarmJob]:
+    """最近请求频率最高的 n 个形状，date 字段替换为新快照的日期"""
+    jobs: List[WarmJob] = []
+    for route, model, fn, params in get_request_stats().top(n):
+        if "date" in model.__fields__:
+            jobs.append((route, model(**params, date=date), date, fn))
+        else:
+            jobs.append((route, model(**params), None, fn))
+    return jobs
+
+
+def _dedupe(jobs: List[WarmJob]) -> List[WarmJob]:
+    seen = set()
+    out = []
+    for job in jobs:
+        key = (job[0], job[1].json(sort_keys=True))
+        if key not in seen:
+            seen.add(key)
+            out.append(job)
+    return out
+
+
+def _timed_prime(route: str, req: BaseModel, date: Optional[str], fn: Callable[[Any], Any]) -> Tuple[bool, float]:
+    t0 = time.thread_time()
+    primed = prime(route, req, date, fn)
+    return primed, time.thread_time() - t0
+
+
+async def _wait_idle(max_wait_s: float) -> None:
+    """等扫描线程池空闲，最多等 max_wait_s 秒"""
+    dispatcher = get_dispatcher()
+    deadline = time.monotonic() + max_wait_s
+    while dispatcher.in_flight > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(WARMER_IDLE_POLL_S)
+
+
+async def run_jobs(jobs: List[WarmJob], cpu_budget_s: Optional[float] = None, idle_only: bool = False) -> Tuple[int, float]:
+    """逐个在扫描线程池中预计算，返回 (新写入响应缓存的数量, 消耗的 CPU 秒)；单个失败不影响其余
+
+    cpu_budget_s: 累计 CPU 时间达到预算后停止；
+    idle_only: 每个任务提交前先等扫描线程池空闲（最多 WARMER_IDLE_MAX_WAIT_S 秒）
+    """
+    primed, spent = 0, 0.0
+    for route, req, date, fn in jobs:
+        if cpu_budget_s is not None and spent >= cpu_budget_s:
+            break
+        if idle_only:
+            await _wait_idle(WARMER_IDLE_MAX_WAIT_S)
+        try:
+            ok, cpu_s = await run_scan(_timed_prime, route, req, date, fn)
+        except HTTPException:
+            continue
+        primed += ok
+        spent += cpu_s
+    return primed, spent
+
+
+async def warm_latest() -> None:
+    catalog = get_catalog()
+    date = catalog.latest_date()
+    if date is None:
+        return
+    bases = list(catalog.manifest(date).get("bases") or [])
+    _status.asof_ts = catalog.snapshot_asof(date)
+    _status.primed += (await run_jobs(default_jobs(date, bases)))[0]
+
+
+async def warm_new_snapshot(asof: int) -> None:
+    """新快照发布后预热：热门形状优先，其次默认请求；受 CPU 预算与空闲条件约束"""
+    catalog = get_catalog()
+    date = catalog.latest_date()
+    if date is None:
+        return
+    bases = list(catalog.manifest(date).get("bases") or [])
+    jobs = _dedupe(popular_jobs(date, WARMER_TOP_SHAPES) + default_jobs(date, bases))
+    t0 = time.perf_counter()
+    primed, cpu_s = await run_jobs(jobs, cpu_budget_s=WARMER_CPU_BUDGET_S, idle_only=True)
+    _status.warmed_asof_ts = asof
+    _status.warmed_primed = primed
+    _status.warmed_cpu_s = round(cpu_s, 3)
+    logger.info("warmer asof=%s primed=%d/%d cpu=%.2fs wall=%.2fs", asof, primed, len(jobs), cpu_s, time.perf_counter() - t0)
+
+
+async def warmer_loop() -> None:
+    """轮询最新快照（LATEST 指针 / catalog 只做 stat），asof_ts 变化时预热"""
+    last_asof = _status.asof_ts
+    while True:
+        await asyncio.sleep(WARMER_POLL_S)
+        try:
+            asof = get_catalog().snapshot_asof()
+            if asof is None or asof == last_asof:
+                continue
+            last_asof = asof
+            await warm_new_snapshot(asof)
+        except Exception as e:  # 预热失败不影响服务，等下一个快照
+            logger.warning("warmer failed: %r", e)
+
+
+async def warmup() -> None:
+    """后台预热入口；无论成功与否最后都标记就绪"""
+    t0 = time.perf_counter()
+    try:
+        if WARMUP_ENABLED:
+            await warm_latest()
+    except Exception as e:  # 预热失败不阻止接流量
+        _status.error = repr(e)
+        logger.warning("warmup failed: %r", e)
+    finally:
+        _status.duration_s = round(time.perf_counter() - t0, 3)
+        _status.ready = True
+    logger.info("warmup ready asof=%s primed=%d in %ss", _status.asof_ts, _status.primed, _status.duration_s)
+
+
+async def _warm_forever() -> None:
+    await warmup()
+    if WARMUP_ENABLED:
+        await warmer_loop()
+
+
+def start_warmup() -> "asyncio.Task":
+    return asyncio.create_task(_warm_forever())
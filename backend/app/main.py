@@ -1,13 +1,29 @@
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 from .api.routes_meta import router as meta_router
 from .api.routes_spread import router as spread_router
 from .api.routes_single_leg import router as single_leg_router
+from .api.warmup import get_warmup_status, start_warmup
+from .services.metrics import begin_request_stages, observe_request, render_metrics, server_timing
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 后台预热最新快照；完成前 /api/ready 返回 503
+    task = start_warmup()
+    try:
+        yield
+    finally:
+        task.cancel()
 
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Spread Finder API", version="0.1.0")
+    app = FastAPI(title="Spread Finder API", version="0.1.0", lifespan=lifespan)
 
     # CORS: allow same-origin and dashboard/internal tools
     app.add_middleware(
@@ -18,6 +34,23 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
 
+    # Per-route latency histogram (labelled by route template, not raw path) + Server-Timing header
+    @app.middleware("http")
+    async def observe_latency(request: Request, call_next):
+        t0 = time.perf_counter()
+        stages = begin_request_stages()
+        response = await call_next(request)
+        elapsed = time.perf_counter() - t0
+        route = request.scope.get("route")
+        observe_request(request.method, getattr(route, "path", "unmatched"), response.status_code, elapsed)
+        response.headers["Server-Timing"] = server_timing(stages, elapsed)
+        return response
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        body, content_type = render_metrics()
+        return Response(content=body, media_type=content_type)
+
     @app.get("/api/health")
     def health():
         return {"status": "ok"}
@@ -26,6 +59,15 @@ def create_app() -> FastAPI:
     def health_prefixed():
         return {"status": "ok"}
 
+    # Readiness: 503 until this worker has warmed the latest snapshot (use this for rolling restarts)
+    @app.get("/api/ready")
+    def ready():
+        status = get_warmup_status()
+        return JSONResponse(status.to_dict(), status_code=200 if status.ready else 503)
+    @app.get("/option-strategy-finder/api/ready")
+    def ready_prefixed():
+        return ready()
+
     # Register routers both at root and under "/option-strategy-finder" to support subpath deployment
     app.include_router(meta_router, prefix="/api")
     app.include_router(spread_router, prefix="/api")
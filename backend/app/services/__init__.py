@@ -1,7 +1,12 @@
 __all__ = [
+    "catalog",
     "loader",
+    "live",
     "scanner",
     "bs",
     "quality",
+    "chain_prep",
+    "ranking",
+    "metrics",
 ]
 
@@ -1,32 +1,64 @@
 from __future__ import annotations
 
-import math
+import numpy as np
+from scipy.special import ndtr
 
 
-SQRT_2 = math.sqrt(2.0)
+def probability_st_ge_k_batch(s, k, vol, t_years, r: float = 0.0) -> np.ndarray:
+    """Vectorized risk-neutral P(S_T >= K) over broadcastable arrays.
+
+    Elements with s<=0, k<=0, vol<=0 or t_years<=0 are NaN; NaN inputs propagate.
+    """
+    s, k, vol, t_years = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (s, k, vol, t_years)))
+    invalid = (s <= 0) | (k <= 0) | (vol <= 0) | (t_years <= 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vt = vol * np.sqrt(t_years)
+        d2 = (np.log(s / k) + (r - 0.5 * vol * vol) * t_years) / vt
+        p = 1.0 - ndtr(d2)
+    return np.where(invalid, np.nan, p)
 
 
-def _norm_cdf(x: float) -> float:
-    # Abramowitz-Stegun approximation via erf for simplicity
-    return 0.5 * (1.0 + math.erf(x / SQRT_2))
+def probability_st_le_k_batch(s, k, vol, t_years, r: float = 0.0) -> np.ndarray:
+    return 1.0 - probability_st_ge_k_batch(s, k, vol, t_years, r)
 
 
 def probability_st_ge_k(s: float, k: float, vol: float, t_years: float, r: float = 0.0) -> float:
     """Risk-neutral P(S_T >= K). Uses lognormal with drift r.
     Returns value in [0,1]. If inputs invalid, returns NaN.
     """
-    if s <= 0 or k <= 0 or vol <= 0 or t_years <= 0:
-        return float("nan")
-    vt = vol * math.sqrt(t_years)
-    d2 = (math.log(s / k) + (r - 0.5 * vol * vol) * t_years) / vt
-    return 1.0 - _norm_cdf(d2)
+    return float(probability_st_ge_k_batch(s, k, vol, t_years, r))
 
 
 def probability_st_le_k(s: float, k: float, vol: float, t_years: float, r: float = 0.0) -> float:
-    p = probability_st_ge_k(s, k, vol, t_years, r)
-    if math.isnan(p):
-        return p
-    return 1.0 - p
+    return float(probability_st_le_k_batch(s, k, vol, t_years, r))
+
+
+def pop_for_vertical_batch(
+    kind: str,
+    side: str,
+    s,
+    k1,
+    k2,
+    premium,
+    vol,
+    t_years,
+    r: float = 0.0,
+) -> np.ndarray:
+    """Vectorized pop_for_vertical: one kind/side, array-valued strikes/premiums/market inputs."""
+    kind_u = kind.upper()
+    side_u = side.upper()
+
+    if kind_u == "CALL":
+        # Debit: long K1, short K2. Credit: short K1, long K2.
+        k = np.asarray(k1, dtype=float) + premium
+        if side_u == "DEBIT":
+            return probability_st_ge_k_batch(s, k, vol, t_years, r)
+        return probability_st_le_k_batch(s, k, vol, t_years, r)
+    # PUT
+    k = np.asarray(k2, dtype=float) - premium
+    if side_u == "DEBIT":
+        return probability_st_le_k_batch(s, k, vol, t_years, r)
+    return probability_st_ge_k_batch(s, k, vol, t_years, r)
 
 
 def pop_for_vertical(
@@ -50,21 +82,4 @@ def pop_for_vertical(
     kind: "CALL" or "PUT"
     side: "DEBIT" or "CREDIT"
     """
-    k = None
-    kind_u = kind.upper()
-    side_u = side.upper()
-
-    if kind_u == "CALL":
-        # Debit: long K1, short K2. Credit: short K1, long K2.
-        k = (k1 + premium)
-        if side_u == "DEBIT":
-            return probability_st_ge_k(s, k, vol, t_years, r)
-        else:
-            return probability_st_le_k(s, k, vol, t_years, r)
-    else:  # PUT
-        k = (k2 - premium)
-        if side_u == "DEBIT":
-            return probability_st_le_k(s, k, vol, t_years, r)
-        else:
-            return probability_st_ge_k(s, k, vol, t_years, r)
-
+    return float(pop_for_vertical_batch(kind, side, s, k1, k2, premium, vol, t_years, r))
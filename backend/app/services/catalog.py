@@ -0,0 +1,186 @@
+"""
+快照目录索引：date -> 最新小时目录、manifest、bases、expiries
+
+每次请求只做一次 DATA_ROOT 的 stat：目录 mtime 不变（没有新增/删除 dt=* 目录）时直接使用内存索引；
+manifest 与到期日列表按 manifest.json 的 mtime 缓存。
+最新快照优先由 ETL 原子写入的 LATEST 指针解析（指针缺失或指向不存在的目录时回退到目录扫描）。
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+DATA_ROOT = Path(__file__).parent.parent.parent / "data" / "parquet"
+
+# ETL 发布快照后原子替换的指针文件：{"dir": "dt=YYYY-MM-DD-HH", "date": "YYYY-MM-DD", "asof_ts": ...}
+LATEST_POINTER = "LATEST"
+
+# 目录 mtime 距今小于该值时不信任（粗粒度时间戳的文件系统上同一时刻内可能还有新目录）
+_MTIME_SETTLE_NS = 2_000_000_000
+
+
+def _is_compacted(day_dir: Path) -> bool:
+    """dt=YYYY-MM-DD 是否为 compact_snapshots 写出的压缩目录（包含当天全部已合并的小时快照）"""
+    try:
+        return "compacted" in json.loads((day_dir / "manifest.json").read_text())
+    except (OSError, ValueError):
+        return False
+
+
+def _stat_mtime(path: Path) -> int:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return -1
+
+
+class SnapshotCatalog:
+    """DATA_ROOT 下 dt=* 快照的内存索引"""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._lock = threading.Lock()
+        self._root_mtime: Optional[int] = None
+        self._dates: List[str] = []
+        self._dirs: Dict[str, Path] = {}
+        # 快照目录 -> (manifest mtime, manifest)
+        self._manifests: Dict[Path, Tuple[int, Dict]] = {}
+        # (快照目录, base) -> (manifest mtime, expiries)
+        self._expiries: Dict[Tuple[Path, str], Tuple[int, List[int]]] = {}
+        # ((指针 mtime, inode), 解析结果)
+        self._pointer: Tuple[Optional[Tuple[int, int]], Optional[Dict]] = (None, None)
+
+    def _refresh(self) -> None:
+        mtime = _stat_mtime(self.root)
+        if mtime == self._root_mtime:
+            return
+        with self._lock:
+            if mtime == self._root_mtime:
+                return
+            hourly: Dict[str, Path] = {}
+            daily: Dict[str, Path] = {}
+            if mtime != -1:
+                for p in self.root.glob("dt=*"):
+                    if not p.is_dir():
+                        continue
+                    timestamp = p.name.split("=", 1)[1]
+                    # 提取日期部分（YYYY-MM-DD），去掉时间部分（小时目录 -HH、实时 checkpoint -HHMMSS）
+                    date = timestamp[:10] if len(timestamp) >= 10 else timestamp
+                    if len(timestamp) > 10:
+                        if date not in hourly or p.name > hourly[date].name:
+                            hourly[date] = p
+                    else:
+                        daily[date] = p
+            dirs = {**daily, **hourly}  # 同一天优先使用最新的小时目录
+            # 压缩目录发布后，已合并的小时目录会延迟一段时间才删除（正在进行的扫描可能仍在读取），
+            # 此时优先使用压缩目录
+            for date in daily.keys() & hourly.keys():
+                if _is_compacted(daily[date]):
+                    dirs[date] = daily[date]
+            self._dirs = dirs
+            self._dates = sorted(dirs)
+            live = set(dirs.values())
+            self._manifests = {k: v for k, v in self._manifests.items() if k in live}
+            self._expiries = {k: v for k, v in self._expiries.items() if k[0] in live}
+            self._root_mtime = mtime if time.time_ns() - mtime >= _MTIME_SETTLE_NS else None
+
+    def latest(self) -> Optional[Dict]:
+        """LATEST 指针内容（date / dir / asof_ts，dir 已解析为 Path）；指针无效时返回 None"""
+        try:
+            st = (self.root / LATEST_POINTER).stat()
+        except FileNotFoundError:
+            return None
+        key = (st.st_mtime_ns, st.st_ino)
+        cached_key, pointer = self._pointer
+        if cached_key != key:
+            try:
+                raw = json.loads((self.root / LATEST_POINTER).read_text())
+                pointer = {"date": str(raw["date"]), "dir": self.root / raw["dir"], "asof_ts": int(raw["asof_ts"])}
+            except (OSError, ValueError, KeyError, TypeError):
+                pointer = None
+            self._pointer = (key, pointer)
+        if pointer is None or not pointer["dir"].is_dir():
+            return None
+        return pointer
+
+    def dates(self) -> List[str]:
+        """所有可用日期（YYYY-MM-DD，升序）"""
+        self._refresh()
+        return list(self._dates)
+
+    def latest_date(self) -> Optional[str]:
+        pointer = self.latest()
+        if pointer is not None:
+            return pointer["date"]
+        self._refresh()
+        return self._dates[-1] if self._dates else None
+
+    def snapshot_dir(self, date: str) -> Path:
+        """指定日期的最新时间戳目录；日期不存在时返回 dt={date}（读取时抛 FileNotFoundError）"""
+        pointer = self.latest()
+        if pointer is not None and pointer["date"] == date:
+            return pointer["dir"]
+        self._refresh()
+        return self._dirs.get(date, self.root / f"dt={date}")
+
+    def manifest_for_dir(self, root: Path) -> Tuple[int, Dict]:
+        """返回 (manifest mtime, manifest)；manifest 为共享对象，调用方不得修改"""
+        mtime = _stat_mtime(root / "manifest.json")
+        if mtime == -1:
+            raise FileNotFoundError(root / "manifest.json")
+        entry = self._manifests.get(root)
+        if entry is not None and entry[0] == mtime:
+            return entry
+        entry = (mtime, json.loads((root / "manifest.json").read_text()))
+        with self._lock:
+            self._manifests[root] = entry
+        return entry
+
+    def manifest(self, date: str) -> Dict:
+        return self.manifest_for_dir(self.snapshot_dir(date))[1]
+
+    def snapshot_asof(self, date: Optional[str] = None) -> Optional[int]:
+        """指定日期（默认最新）快照的 asof_ts，用作结果缓存 / 请求合并的快照标识；无数据时返回 None"""
+        if date is None:
+            date = self.latest_date()
+            if date is None:
+                return None
+        try:
+            return int(self.manifest(date).get("asof_ts", 0))
+        except FileNotFoundError:
+            return None
+
+    def expiries(self, date: str, base: str) -> List[int]:
+        root = self.snapshot_dir(date)
+        mtime = _stat_mtime(root / "manifest.json")
+        entry = self._expiries.get((root, base))
+        if entry is not None and entry[0] == mtime:
+            return list(entry[1])
+
+        out = sorted(int(p.parent.name.split("=", 1)[1]) for p in (root / f"base={base}").glob("expiry=*/chain.parquet"))
+        if not out:
+            # fall back to manifest if written differently
+            out = list(self.manifest_for_dir(root)[1].get("expiries", {}).get(base, []))
+        with self._lock:
+            self._expiries[(root, base)] = (mtime, out)
+        return list(out)
+
+
+_catalog: Optional[SnapshotCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> SnapshotCatalog:
+    """当前 DATA_ROOT 的进程级目录索引（DATA_ROOT 被替换时重建）"""
+    global _catalog
+    catalog = _catalog
+    if catalog is None or catalog.root != DATA_ROOT:
+        with _catalog_lock:
+            if _catalog is None or _catalog.root != DATA_ROOT:
+                _catalog = SnapshotCatalog(DATA_ROOT)
+            catalog = _catalog
+    return catalog
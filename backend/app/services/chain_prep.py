@@ -0,0 +1,138 @@
+"""
+期权链预处理：四个扫描器（scan_buckets / scan_opinion_spreads / scan_csp / scan_cc）共用
+
+同一快照只计算一次 mid、quality_flag、spread_ratio、dte 和期权类型掩码，
+结果按输入 DataFrame 的身份 + asof_ts 在进程内缓存（loader 对同一快照返回同一对象）。
+缓存条目持有源 DataFrame 的引用（loader 的链缓存可能已将其淘汰），按预处理结果的总字节数计入上限
+（含与源共享的列），因此两级缓存合计不超过 SPREAD_CHAIN_CACHE_MAX_BYTES + SPREAD_PREP_CACHE_MAX_BYTES。
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .loader import CHAIN_COLUMNS, MS_PER_DAY
+from .metrics import record_cache, timed_stage
+from .quality import QUALITY_LABELS, assess_quotes
+
+
+REQUIRED_COLUMNS = CHAIN_COLUMNS
+
+PREP_CACHE_MAX_BYTES = int(os.environ.get("SPREAD_PREP_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+PREP_CACHE_MAX_ENTRIES = int(os.environ.get("SPREAD_PREP_CACHE_MAX_ENTRIES", 32))
+
+_QUALITY_LABELS = np.array(QUALITY_LABELS, dtype=object)
+
+
+def _build_prepared(df: pd.DataFrame, asof: int) -> pd.DataFrame:
+    # 浅拷贝：原始列与 loader 缓存（可能是 memory-map 的 Arrow 内存）共享，只新增派生列
+    out = df.copy(deep=False)
+    for c in REQUIRED_COLUMNS:
+        if c not in out.columns:
+            out[c] = np.nan
+
+    mid, code, spread_ratio = assess_quotes(out["bid"], out["ask"], out["mark_price"])
+    out["mid"] = mid
+    out["quality_flag"] = _QUALITY_LABELS[code]
+    out["quality_code"] = code
+    out["spread_ratio"] = spread_ratio
+    out["dte"] = (out["expiry_ts"] - asof) / MS_PER_DAY
+    opt = out["option_type"].str.upper()
+    out["is_call"] = (opt == "C").to_numpy()
+    out["is_put"] = (opt == "P").to_numpy()
+    return out
+
+
+class _PreparedCache:
+    """按源 DataFrame 身份缓存预处理结果（持有源对象引用，避免 id 复用），LRU + 字节上限"""
+
+    def __init__(self, max_bytes: int, max_entries: int):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, int], Tuple[pd.DataFrame, pd.DataFrame, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, df: pd.DataFrame, asof: int) -> Optional[pd.DataFrame]:
+        key = (id(df), asof)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not df:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, df: pd.DataFrame, asof: int, prepared: pd.DataFrame) -> None:
+        # 预处理结果包含源 DataFrame 的全部列，其大小即该条目实际占用的内存上界
+        nbytes = int(prepared.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        key = (id(df), asof)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (df, prepared, nbytes)
+            self._bytes += nbytes
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                self._drop(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _drop(self, key: Tuple[int, int]) -> None:
+        _, _, nbytes = self._entries.pop(key)
+        self._bytes -= nbytes
+
+
+_prepared_cache = _PreparedCache(PREP_CACHE_MAX_BYTES, PREP_CACHE_MAX_ENTRIES)
+
+
+def clear_prepared_cache() -> None:
+    _prepared_cache.clear()
+
+
+def chain_base(chain_df: pd.DataFrame, meta) -> str:
+    """结果中的标的：优先取 meta.base（按 DTE / 类型裁剪后的链可能为空）"""
+    base = getattr(meta, "base", None)
+    if base:
+        return base
+    return chain_df["base"].iloc[0] if not chain_df.empty else ""
+
+
+def chain_spot(chain_df: pd.DataFrame, meta) -> Optional[float]:
+    """结果中的现货价：manifest 的标准指数价格，否则回退到整条链 underlying 的中位数
+
+    回退值优先取 meta.spot_fallback（loader 在裁剪前计算），以免裁剪改变定价输入。
+    """
+    if meta.spot_price is not None:
+        return meta.spot_price
+    spot_fallback = getattr(meta, "spot_fallback", None)
+    if spot_fallback is not None:
+        return spot_fallback
+    if not chain_df.empty and "underlying" in chain_df.columns:
+        underlying_vals = chain_df["underlying"].dropna()
+        if len(underlying_vals) > 0:
+            return float(underlying_vals.median())  # 使用中位数更稳健
+    return None
+
+
+def prepare_chain(chain_df: pd.DataFrame, meta) -> pd.DataFrame:
+    """返回预处理后的期权链（共享对象，调用方不得原地修改）
+
+    新增列：mid, quality_flag, quality_code, spread_ratio, dte, is_call, is_put
+    """
+    asof = int(meta.asof_ts)
+    with timed_stage("prep"):
+        prepared = _prepared_cache.get(chain_df, asof)
+        record_cache("prep", prepared is not None)
+        if prepared is None:
+            prepared = _build_prepared(chain_df, asof)
+            _prepared_cache.put(chain_df, asof, prepared)
+    return prepared
@@ -0,0 +1,172 @@
+"""
+实时期权链：按 instrument 维护最新报价，由 WebSocket ingest（scripts/ws_ingest.py）增量更新
+
+snapshot(base) 返回与 loader.load_chain_for 相同形态的 (DataFrame, ChainMeta)，扫描器可直接使用，例如
+``scan_buckets(*live.snapshot("BTC"), tenor="near", direction="up")``。
+两次更新之间返回同一个 DataFrame 对象，chain_prep 的预处理缓存因此可以复用。
+"""
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .loader import CHAIN_COLUMNS, ChainMeta
+
+
+# book summary / ticker 字段 -> 期权链字段
+_BOOK_FIELDS = {
+    "bid_price": "bid",
+    "ask_price": "ask",
+    "mark_price": "mark_price",
+    "mark_iv": "mark_iv",
+    "underlying_price": "underlying",
+    "open_interest": "oi",
+}
+_QUOTE_FIELDS = list(_BOOK_FIELDS.values())
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _side_price(price: Optional[float], amount: Optional[float]) -> Optional[float]:
+    # ticker 用 0 价格 / 0 数量表示该侧无报价，与 book summary 的 null 对齐
+    if not price or (amount is not None and amount <= 0):
+        return None
+    return float(price)
+
+
+class LiveChain:
+    """线程安全的实时期权链（多个 base）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # instrument -> {base, expiry_ts, strike, option_type}
+        self._instruments: Dict[str, Dict] = {}
+        # instrument -> {bid, ask, mark_price, mark_iv, underlying, oi}
+        self._quotes: Dict[str, Dict[str, Optional[float]]] = {}
+        self._spot: Dict[str, float] = {}
+        self._dvol: Dict[str, Optional[float]] = {}
+        self._updated_ts: Dict[str, int] = {}
+        self._versions: Dict[str, int] = {}
+        # base -> (version, DataFrame, ChainMeta)
+        self._snapshots: Dict[str, Tuple[int, pd.DataFrame, ChainMeta]] = {}
+
+    def set_instruments(self, base: str, instruments: Iterable[Dict]) -> List[str]:
+        """用 get_instruments 的结果替换某个 base 的合约集合，返回新增的合约名"""
+        fresh = {}
+        for it in instruments:
+            fresh[it["instrument_name"]] = {
+                "base": str(it.get("base_currency") or base),
+                "expiry_ts": int(it["expiration_timestamp"]),
+                "strike": float(it["strike"]),
+                "option_type": "C" if str(it.get("option_type", "")).lower().startswith("c") else "P",
+            }
+        with self._lock:
+            stale = [n for n, meta in self._instruments.items() if meta["base"] == base and n not in fresh]
+            for name in stale:
+                self._instruments.pop(name, None)
+                self._quotes.pop(name, None)
+            added = [n for n in fresh if n not in self._instruments]
+            self._instruments.update(fresh)
+            self._touch(base)
+        return added
+
+    def instruments(self, base: str) -> List[str]:
+        with self._lock:
+            return [n for n, meta in self._instruments.items() if meta["base"] == base]
+
+    def apply_book_summary(self, base: str, rows: Iterable[Dict]) -> None:
+        """用 get_book_summary_by_currency 的结果整体刷新报价（订阅建立前的初始状态）"""
+        with self._lock:
+            for row in rows:
+                name = row.get("instrument_name")
+                if name in self._instruments:
+                    self._quotes[name] = {dst: row.get(src) for src, dst in _BOOK_FIELDS.items()}
+            self._touch(base)
+
+    def apply_ticker(self, data: Dict) -> bool:
+        """应用一条 ticker 通知；合约未知时返回 False"""
+        name = data.get("instrument_name")
+        with self._lock:
+            meta = self._instruments.get(name)
+            if meta is None:
+                return False
+            self._quotes[name] = {
+                "bid": _side_price(data.get("best_bid_price"), data.get("best_bid_amount")),
+                "ask": _side_price(data.get("best_ask_price"), data.get("best_ask_amount")),
+                "mark_price": data.get("mark_price"),
+                "mark_iv": data.get("mark_iv"),
+                "underlying": data.get("underlying_price"),
+                "oi": data.get("open_interest"),
+            }
+            self._touch(meta["base"], data.get("timestamp"))
+        return True
+
+    def set_index_price(self, base: str, price: float, ts: Optional[int] = None) -> None:
+        with self._lock:
+            self._spot[base] = float(price)
+            self._touch(base, ts)
+
+    def set_dvol(self, base: str, value: Optional[float]) -> None:
+        with self._lock:
+            self._dvol[base] = value
+            self._versions[base] = self._versions.get(base, 0) + 1
+
+    def version(self, base: str) -> int:
+        return self._versions.get(base, 0)
+
+    def spot_price(self, base: str) -> Optional[float]:
+        return self._spot.get(base)
+
+    def _touch(self, base: str, ts: Optional[int] = None) -> None:
+        self._versions[base] = self._versions.get(base, 0) + 1
+        self._updated_ts[base] = max(self._updated_ts.get(base, 0), int(ts) if ts else _now_ms())
+
+    def snapshot(self, base: str) -> Tuple[pd.DataFrame, ChainMeta]:
+        """当前报价的期权链（CHAIN_COLUMNS，剔除已到期合约，按 expiry_ts, option_type, strike 排序）。
+
+        返回的 DataFrame 为共享对象，调用方不得原地修改。
+        """
+        with self._lock:
+            version = self._versions.get(base, 0)
+            cached = self._snapshots.get(base)
+            if cached is not None and cached[0] == version:
+                return cached[1], cached[2]
+
+            asof = self._updated_ts.get(base, _now_ms())
+            names = [
+                n for n, meta in self._instruments.items()
+                if meta["base"] == base and n in self._quotes and meta["expiry_ts"] > asof
+            ]
+            metas = [self._instruments[n] for n in names]
+            quotes = [self._quotes[n] for n in names]
+            spot = self._spot.get(base)
+            dvol = self._dvol.get(base)
+            bases = sorted({m["base"] for m in self._instruments.values()})
+
+        date = datetime.fromtimestamp(asof / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+        df = pd.DataFrame({
+            "date": date,
+            "base": pd.Series([m["base"] for m in metas], dtype=object),
+            "instrument": pd.Series(names, dtype=object),
+            "expiry_ts": np.array([m["expiry_ts"] for m in metas], dtype=np.int64),
+            "strike": np.array([m["strike"] for m in metas], dtype=float),
+            "option_type": pd.Series([m["option_type"] for m in metas], dtype=object),
+            **{f: np.array([q[f] for q in quotes], dtype=float) for f in _QUOTE_FIELDS},
+            "asof_ts": np.full(len(names), asof, dtype=np.int64),
+        }, columns=CHAIN_COLUMNS)
+        df = df.sort_values(["expiry_ts", "option_type", "strike"], kind="stable").reset_index(drop=True)
+        meta = ChainMeta(date=date, asof_ts=asof, bases=bases, spot_price=spot, dvol_index=dvol, base=base)
+        if spot is None and df["underlying"].notna().any():
+            meta.spot_fallback = float(df["underlying"].dropna().median())
+
+        with self._lock:
+            if self._versions.get(base, 0) == version:
+                self._snapshots[base] = (version, df, meta)
+        return df, meta
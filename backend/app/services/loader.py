@@ -1,66 +1,74 @@
 from __future__ import annotations
 
-import json
+import os
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
+from .catalog import DATA_ROOT, get_catalog  # noqa: F401  DATA_ROOT 保留为 loader 的公开属性
+from .metrics import record_cache, timed_stage
 
-DATA_ROOT = Path(__file__).parent.parent.parent / "data" / "parquet"
+
+# 进程内期权链缓存上限（可通过环境变量调整）
+CHAIN_CACHE_MAX_BYTES = int(os.environ.get("SPREAD_CHAIN_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+CHAIN_CACHE_MAX_ENTRIES = int(os.environ.get("SPREAD_CHAIN_CACHE_MAX_ENTRIES", 64))
+PARTITION_INDEX_MAX_ENTRIES = int(os.environ.get("SPREAD_PARTITION_INDEX_MAX_ENTRIES", 256))
+
+# 扫描器使用的期权链字段及类型：读取时只投影这些列，缺失列补 null，类型不一致的分区按此转换
+CHAIN_SCHEMA = pa.schema([
+    ("date", pa.string()),
+    ("base", pa.string()),
+    ("instrument", pa.string()),
+    ("expiry_ts", pa.int64()),
+    ("strike", pa.float64()),
+    ("option_type", pa.string()),
+    ("bid", pa.float64()),
+    ("ask", pa.float64()),
+    ("mark_price", pa.float64()),
+    ("mark_iv", pa.float64()),
+    ("underlying", pa.float64()),
+    ("oi", pa.float64()),
+    ("asof_ts", pa.int64()),
+])
+CHAIN_COLUMNS = CHAIN_SCHEMA.names
+
+MS_PER_DAY = 1000 * 60 * 60 * 24
 
 
 def _date_dir(date: str) -> Path:
     """获取指定日期的最新时间戳目录"""
-    # 查找该日期的所有时间戳目录（dt=YYYY-MM-DD-HH 格式）
-    matching_dirs = sorted(DATA_ROOT.glob(f"dt={date}-*"), reverse=True)
-    if matching_dirs:
-        return matching_dirs[0]  # 返回最新的（小时最大的）
-    # 向后兼容：如果没有找到带时间戳的，尝试旧格式
-    return DATA_ROOT / f"dt={date}"
+    return get_catalog().snapshot_dir(date)
 
 
 def get_manifest(date: str) -> Dict:
-    mpath = _date_dir(date) / "manifest.json"
-    if not mpath.exists():
-        raise FileNotFoundError(mpath)
-    return json.loads(mpath.read_text())
+    """指定日期最新快照的 manifest（目录索引缓存的共享对象，调用方不得修改）"""
+    return get_catalog().manifest(date)
 
 
 def list_available_dates() -> List[str]:
     """列出所有可用的日期（YYYY-MM-DD格式）"""
-    if not DATA_ROOT.exists():
-        return []
-    dates_set = set()
-    for p in sorted(DATA_ROOT.glob("dt=*")):
-        if p.is_dir():
-            timestamp = p.name.split("=", 1)[1]
-            # 提取日期部分（YYYY-MM-DD），去掉小时部分（-HH）
-            date = timestamp[:10] if len(timestamp) >= 10 else timestamp
-            dates_set.add(date)
-    return sorted(list(dates_set))
+    return get_catalog().dates()
 
 
 def get_latest_date() -> str:
     """获取最新的数据日期"""
-    dates = list_available_dates()
-    if not dates:
+    date = get_catalog().latest_date()
+    if date is None:
         raise FileNotFoundError("No data available")
-    return dates[-1]
+    return date
 
 
 def list_expiries_for(date: str, base: str) -> List[int]:
-    root = _date_dir(date)
-    out: List[int] = []
-    for p in sorted((root / f"base={base}").glob("expiry=*/chain.parquet")):
-        exp = int(p.parent.name.split("=", 1)[1])
-        out.append(exp)
-    if not out:
-        # fall back to manifest if written differently
-        manifest = get_manifest(date)
-        out = manifest.get("expiries", {}).get(base, [])
-    return out
+    return get_catalog().expiries(date, base)
 
 
 @dataclass
@@ -70,34 +78,263 @@ class ChainMeta:
     bases: List[str]
     spot_price: float | None = None  # 新增：标准现货指数价格
     dvol_index: float | None = None  # 新增：DVOL波动率指数
+    # 请求的标的与现货价回退值（manifest 无现货价时整条链 underlying 的中位数），
+    # 均取自裁剪前的快照，裁剪后的链为空或只含部分到期日时扫描器的输出不变
+    base: str | None = None
+    spot_fallback: float | None = None
+
+
+class _ChainCache:
+    """按 (快照目录, base, 分区选择) 缓存已加载的 (DataFrame, ChainMeta)，LRU + 字节上限。
+
+    新的 dt=YYYY-MM-DD-HH 目录出现时 _date_dir 会解析到新目录（键不同）；
+    同一目录下 manifest.json 的 mtime 变化时旧条目视为失效。
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[int, int, pd.DataFrame, ChainMeta]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple, manifest_mtime: int) -> Optional[Tuple[pd.DataFrame, ChainMeta]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            mtime, _, df, meta = entry
+            if mtime != manifest_mtime:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return df, meta
+
+    def put(self, key: Tuple, manifest_mtime: int, df: pd.DataFrame, meta: ChainMeta) -> None:
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (manifest_mtime, nbytes, df, meta)
+            self._bytes += nbytes
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                self._drop(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _drop(self, key: Tuple) -> None:
+        _, nbytes, _, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+
+_chain_cache = _ChainCache(CHAIN_CACHE_MAX_BYTES, CHAIN_CACHE_MAX_ENTRIES)
+
+
+def clear_chain_cache() -> None:
+    _chain_cache.clear()
+    _partition_index.clear()
+
+
+class _PartitionIndex:
+    """(快照目录, base) -> (manifest mtime, manifest, [(expiry_ts, parquet 路径)])，LRU + 条目上限。
+
+    扫描线程池中的多个线程并发读写，与 _ChainCache 一样用锁保护；列目录 / 读 footer 在锁外进行。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[int, Dict, List[Tuple[int, Path]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str], manifest_mtime: int) -> Optional[Tuple[int, Dict, List[Tuple[int, Path]]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != manifest_mtime:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Tuple[str, str], entry: Tuple[int, Dict, List[Tuple[int, Path]]]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_partition_index = _PartitionIndex(PARTITION_INDEX_MAX_ENTRIES)
 
 
-def load_chain_for(date: str, base: str) -> Tuple[pd.DataFrame, ChainMeta]:
-    root = _date_dir(date)
-    # support both layout styles: base/expiry and flat expiry folders
-    parquet_paths = list((root / f"base={base}").glob("expiry=*/chain.parquet"))
-    if not parquet_paths:
-        # try layout: dt=/base=BTC/expiry=... else dt=/expiry=.../base=BTC
-        parquet_paths = list(root.glob(f"**/base={base}/expiry=*/chain.parquet"))
-    if not parquet_paths:
+def _expiry_partitions(root: Path, base: str) -> Tuple[int, Dict, List[Tuple[int, Path]]]:
+    """快照下某个 base 的 (manifest mtime, manifest, 按到期日升序的分区列表)（随 manifest mtime 失效）"""
+    mtime, manifest = get_catalog().manifest_for_dir(root)
+    key = (str(root), base)
+    entry = _partition_index.get(key, mtime)
+    if entry is not None:
+        return entry
+
+    consolidated = root / f"base={base}" / "chain.parquet"
+    if consolidated.exists():
+        # 新布局：每个 base 一个文件，到期日来自 row group 统计
+        parts = [(exp, consolidated) for exp in _row_group_expiries(consolidated)]
+    else:
+        # support both layout styles: base/expiry and flat expiry folders
+        parquet_paths = list((root / f"base={base}").glob("expiry=*/chain.parquet"))
+        if not parquet_paths:
+            # try layout: dt=/base=BTC/expiry=... else dt=/expiry=.../base=BTC
+            parquet_paths = list(root.glob(f"**/base={base}/expiry=*/chain.parquet"))
+        parts = sorted((int(p.parent.name.split("=", 1)[1]), p) for p in parquet_paths)
+    entry = (mtime, manifest, parts)
+    _partition_index.put(key, entry)
+    return entry
+
+
+def _row_group_expiries(path: Path) -> List[int]:
+    """读取合并文件 footer 中 expiry_ts 的 row group 统计；统计缺失或未按到期日对齐时读取该列"""
+    md = pq.read_metadata(path)
+    col = md.schema.names.index("expiry_ts")
+    expiries = set()
+    for i in range(md.num_row_groups):
+        stats = md.row_group(i).column(col).statistics
+        if stats is None or not stats.has_min_max or stats.min != stats.max:
+            column = pq.read_table(path, columns=["expiry_ts"]).column("expiry_ts")
+            return sorted(int(x) for x in pc.unique(column).to_pylist())
+        expiries.add(int(stats.min))
+    return sorted(expiries)
+
+
+def load_chain_for(
+    date: str,
+    base: str,
+    dte_range: Optional[Tuple[float, float]] = None,
+    option_type: Optional[str] = None,
+) -> Tuple[pd.DataFrame, ChainMeta]:
+    """加载指定日期/标的的期权链。
+
+    dte_range: 只读取 DTE 落在 [min, max]（天，含端点）内的到期分区：旧布局按目录名中的 expiry 跳过文件，
+               合并布局按 expiry_ts 谓词跳过 row group
+    option_type: "C" / "P"，下推到 parquet 读取的过滤条件
+    裁剪只会多读不会少读，扫描器仍按自身条件过滤；meta.base / meta.spot_fallback 不受裁剪影响。
+
+    结果在进程内缓存，返回的 DataFrame 为共享对象，调用方不得原地修改。
+    """
+    with timed_stage("resolve"):
+        root = _date_dir(date)
+        mtime, manifest_d, parts = _expiry_partitions(root, base)
+    if not parts:
         raise FileNotFoundError(f"No parquet under {root} for base={base}")
 
-    dfs = [pd.read_parquet(p) for p in parquet_paths]
-    df = pd.concat(dfs, ignore_index=True)
+    all_parts = parts
+    if dte_range is not None:
+        asof = int(manifest_d.get("asof_ts", 0))
+        parts = [(exp, p) for exp, p in parts if dte_range[0] <= (exp - asof) / MS_PER_DAY <= dte_range[1]]
+    if option_type is not None:
+        option_type = option_type.upper()
+
+    # 选中的分区集合相同即共享缓存（例如 max_dte=59 与 60 通常命中同一组到期日）
+    key = (str(root), base, tuple(exp for exp, _ in parts), option_type)
+    cached = _chain_cache.get(key, mtime)
+    record_cache("chain", cached is not None)
+    if cached is not None:
+        return cached
+
+    with timed_stage("load"):
+        df = _read_partitions(parts, option_type, pruned=dte_range is not None)
+        meta = _meta_from_manifest(manifest_d, date, base)
+        if meta.spot_price is None:
+            meta.spot_fallback = _median_underlying(all_parts)
+    _chain_cache.put(key, mtime, df, meta)
+    return df, meta
+
+
+def _read_partitions(parts: List[Tuple[int, Path]], option_type: Optional[str], pruned: bool) -> pd.DataFrame:
+    """以 pyarrow dataset 并发读取选中的分区，只投影 CHAIN_COLUMNS，最后一次性转换为 pandas
 
-    manifest_d = get_manifest(date)
+    合并布局下多个到期日共享同一文件，裁剪时用 expiry_ts 区间谓词借助 row group 统计跳过其余到期日。
+    """
+    if not parts:
+        return CHAIN_SCHEMA.empty_table().to_pandas()
+    paths = list(dict.fromkeys(str(p) for _, p in parts))
+    if len(paths) == 1 and Path(paths[0]).name == "chain.parquet":
+        arrow_path = Path(paths[0]).with_suffix(".arrow")
+        try:
+            return _read_arrow(arrow_path, parts, option_type, pruned)
+        except FileNotFoundError:
+            # 只有最近的快照带 Arrow 副本（ETL 会删除较早快照的副本）
+            pass
+    dataset = ds.dataset(paths, schema=CHAIN_SCHEMA, format="parquet")
+
+    row_filter = None
+    if pruned:
+        row_filter = (ds.field("expiry_ts") >= parts[0][0]) & (ds.field("expiry_ts") <= parts[-1][0])
+    if option_type:
+        type_filter = ds.field("option_type").isin([option_type, option_type.lower()])
+        row_filter = type_filter if row_filter is None else row_filter & type_filter
+    table = dataset.to_table(columns=CHAIN_COLUMNS, filter=row_filter, use_threads=True)
+    return table.to_pandas()
+
+
+def _read_arrow(path: Path, parts: List[Tuple[int, Path]], option_type: Optional[str], pruned: bool) -> pd.DataFrame:
+    """memory-map ETL 写出的 Arrow IPC 文件（按 option_type, expiry_ts, strike 排序）。
+
+    数据页由 OS 页缓存在各 worker 进程间共享；选中的行连续时直接切片，
+    无空值的数值列转 pandas 时不复制，仍指向映射内存。
+    """
+    table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+
+    mask = None
+    if option_type:
+        mask = pc.equal(pc.utf8_upper(table.column("option_type")), option_type).to_numpy(zero_copy_only=False)
+    if pruned:
+        expiry = table.column("expiry_ts").to_numpy()
+        in_range = (expiry >= parts[0][0]) & (expiry <= parts[-1][0])
+        mask = in_range if mask is None else mask & in_range
+    if mask is not None:
+        rows = np.flatnonzero(mask)
+        if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+            table = table.slice(int(rows[0]), len(rows))
+        else:
+            table = table.take(rows)
+
+    columns = []
+    for field in CHAIN_SCHEMA:
+        if field.name not in table.column_names:
+            columns.append(pa.nulls(table.num_rows, field.type))
+            continue
+        col = table.column(field.name)
+        columns.append(col if col.type == field.type else col.cast(field.type))
+    return pa.table(columns, schema=CHAIN_SCHEMA).to_pandas(split_blocks=True)
+
+
+def _median_underlying(parts: List[Tuple[int, Path]]) -> Optional[float]:
+    """整条链（全部到期日与期权类型）underlying 的中位数，只读取这一列"""
+    paths = list(dict.fromkeys(str(p) for _, p in parts))
+    table = ds.dataset(paths, schema=CHAIN_SCHEMA, format="parquet").to_table(columns=["underlying"])
+    underlying_vals = table.column("underlying").to_pandas().dropna()
+    return float(underlying_vals.median()) if len(underlying_vals) > 0 else None
+
+
+def _meta_from_manifest(manifest_d: Dict, date: str, base: str) -> ChainMeta:
     spot_prices = manifest_d.get("spot_prices", {})
     spot_price = spot_prices.get(base) if spot_prices else None
 
     dvol_indices = manifest_d.get("dvol_indices", {})
     dvol_index = dvol_indices.get(base) if dvol_indices else None
 
-    meta = ChainMeta(
+    return ChainMeta(
         date=date,
         asof_ts=int(manifest_d.get("asof_ts", 0)),
         bases=manifest_d.get("bases", []),
         spot_price=spot_price,
         dvol_index=dvol_index,
+        base=base,
     )
-    return df, meta
-
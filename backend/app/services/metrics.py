@@ -0,0 +1,149 @@
+"""
+Prometheus 指标：路由延迟、扫描各阶段耗时、枚举/入选数量、缓存命中、快照新鲜度
+
+- 多 worker 部署时设置 PROMETHEUS_MULTIPROC_DIR（启动前清空该目录），各进程写各自的 mmap 文件，
+  /metrics 由任一 worker 汇总；未设置时只导出当前进程的指标
+- 快照 asof / 年龄在抓取时从 catalog 计算（只做 stat），不需要在请求路径上维护 gauge
+- 阶段耗时用 timed_stage 包裹；循环内的阶段先本地累加，每次扫描只 observe 一次
+- 同时累加到当前请求的 contextvar（begin_request_stages），用于 Server-Timing 响应头；
+  扫描线程池以 copy_context().run 执行任务，线程内记录的阶段归属发起请求；
+  被合并的请求共享同一次计算的阶段耗时（add_request_stages），并以 coalesced 标明等待共享结果的时间
+"""
+from __future__ import annotations
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    disable_created_metrics,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from .catalog import get_catalog
+
+
+# 不导出 *_created 序列，减少每次抓取的输出量
+disable_created_metrics()
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REQUEST_SECONDS = Histogram(
+    "spread_http_request_duration_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+STAGE_SECONDS = Histogram(
+    "spread_stage_duration_seconds", "Time spent per scan stage (resolve/load/prep/enumerate/pop/rank/serialize)",
+    ["stage"], buckets=STAGE_BUCKETS,
+)
+PAIRS_ENUMERATED = Counter("spread_pairs_enumerated", "Vertical spread pairs enumerated", ["scanner"])
+CANDIDATES_KEPT = Counter("spread_candidates_kept", "Candidates returned to the client", ["scanner"])
+CACHE_REQUESTS = Counter("spread_cache_requests", "Cache lookups by cache and result", ["cache", "result"])
+
+# Server-Timing 的分组：指标阶段 → 对外的 load / prep / scan / serialize
+SERVER_TIMING_GROUPS = {
+    "load": ("resolve", "load"),
+    "prep": ("prep",),
+    "scan": ("enumerate", "rank", "pop"),
+    "serialize": ("serialize",),
+}
+
+_request_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar("spread_request_stages", default=None)
+
+
+def begin_request_stages() -> Dict[str, float]:
+    """为当前请求（及其派生的任务 / 复制了上下文的线程）开始收集阶段耗时"""
+    stages: Dict[str, float] = {}
+    _request_stages.set(stages)
+    return stages
+
+
+def add_request_stages(stages: Dict[str, float]) -> None:
+    """把另一次计算的阶段耗时计入当前请求（只影响 Server-Timing，不重复计入直方图）"""
+    current = _request_stages.get()
+    if current is not None:
+        for stage, seconds in stages.items():
+            current[stage] = current.get(stage, 0.0) + seconds
+
+
+def server_timing(stages: Dict[str, float], total_s: float) -> str:
+    parts = [f"{name};dur={sum(stages.get(s, 0.0) for s in members) * 1000:.2f}" for name, members in SERVER_TIMING_GROUPS.items()]
+    if "coalesced" in stages:
+        parts.append(f"coalesced;dur={stages['coalesced'] * 1000:.2f}")
+    parts.append(f"total;dur={total_s * 1000:.2f}")
+    return ", ".join(parts)
+
+
+_stage_children: Dict[str, Histogram] = {}
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    # 缓存带标签的子指标，避免每次 observe 都走 labels() 的加锁查找
+    child = _stage_children.get(stage)
+    if child is None:
+        child = _stage_children.setdefault(stage, STAGE_SECONDS.labels(stage))
+    child.observe(seconds)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - t0)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float) -> None:
+    REQUEST_SECONDS.labels(method, route, str(status)).observe(seconds)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_scan(scanner: str, enumerated: int, kept: int) -> None:
+    if enumerated:
+        PAIRS_ENUMERATED.labels(scanner).inc(enumerated)
+    CANDIDATES_KEPT.labels(scanner).inc(kept)
+
+
+class _SnapshotCollector:
+    """抓取时计算最新快照的 asof 与年龄"""
+
+    def collect(self):
+        asof = get_catalog().snapshot_asof()
+        asof_g = GaugeMetricFamily("spread_snapshot_asof_timestamp_seconds", "asof_ts of the latest published snapshot")
+        age_g = GaugeMetricFamily("spread_snapshot_age_seconds", "Seconds since the latest published snapshot's asof_ts")
+        if asof is not None:
+            asof_g.add_metric([], asof / 1000)
+            age_g.add_metric([], time.time() - asof / 1000)
+        yield asof_g
+        yield age_g
+
+
+_snapshot_collector = _SnapshotCollector()
+REGISTRY.register(_snapshot_collector)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Prometheus 文本格式；多进程模式下汇总所有 worker"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_snapshot_collector)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,6 +1,17 @@
 from __future__ import annotations
 
-from typing import Optional
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+# 质量标记的整数编码（数组化路径使用），顺序与 QUALITY_LABELS 对应
+QUALITY_OK = 0
+QUALITY_WIDE_SPREAD = 1
+QUALITY_INVALID = 2
+QUALITY_MISSING = 3
+QUALITY_LABELS = ("ok", "wide_spread", "invalid", "missing")
+QUALITY_CODES = {label: code for code, label in enumerate(QUALITY_LABELS)}
 
 
 def compute_mid(bid: Optional[float], ask: Optional[float], mark: Optional[float]) -> Optional[float]:
@@ -25,3 +36,36 @@ def spread_flag(bid: Optional[float], ask: Optional[float], mid: Optional[float]
         return "wide_spread"
     return "ok"
 
+
+def assess_quotes(bid, ask, mark, threshold: float = 0.15) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """compute_mid / spread_flag / spread_ratio 的数组版本，一次 NumPy 计算完成。
+
+    NaN/None 视为缺失。返回 (mid, quality_code, spread_ratio)：
+    - mid: 与 compute_mid 相同的回退顺序（bid/ask 均值 → mark → bid → ask），无报价为 NaN
+    - quality_code: QUALITY_* 整数编码，含义与 spread_flag 一致
+    - spread_ratio: (ask - bid) / ((ask + bid) / 2)，bid<=0 或 ask<=0 或缺失时为 +inf
+    """
+    bid = np.asarray(bid, dtype=float)
+    ask = np.asarray(ask, dtype=float)
+    mark = np.asarray(mark, dtype=float)
+    has_bid = ~np.isnan(bid)
+    has_ask = ~np.isnan(ask)
+    both = has_bid & has_ask
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mid = np.where(
+            both,
+            0.5 * (bid + ask),
+            np.where(~np.isnan(mark), mark, np.where(has_bid, bid, ask)),
+        )
+
+        code = np.full(bid.shape, QUALITY_OK, dtype=np.int8)
+        code[(ask - bid) / mid > threshold] = QUALITY_WIDE_SPREAD
+        code[ask < bid] = QUALITY_INVALID
+        code[~both | (mid <= 0)] = QUALITY_MISSING
+
+        half = (bid + ask) / 2.0
+        priced = both & (bid > 0) & (ask > 0) & (half > 0)
+        spread_ratio = np.where(priced, (ask - bid) / half, np.inf)
+
+    return mid, code, spread_ratio
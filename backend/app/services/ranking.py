@@ -0,0 +1,39 @@
+"""
+有界 Top-K 选择：在指标数组上用 argpartition 截取候选，只对候选排序
+
+各扫描器只为最终入选的行构造响应 dict，避免为所有候选组合分配对象后整体排序。
+"""
+from __future__ import annotations
+
+from typing import Sequence
+
+import numpy as np
+
+
+def slice_count(n: int, k: int) -> int:
+    """lst[:k] 语义下实际返回的条数（兼容 k 为负数）"""
+    if k < 0:
+        return max(n + k, 0)
+    return min(k, n)
+
+
+def top_k_indices(keys: Sequence[np.ndarray], k: int) -> np.ndarray:
+    """按 keys 字典序升序（keys[0] 为主键）返回前 k 行的下标，完全并列时按原始位置先后
+
+    与对全部候选做稳定排序后取前 k 个的结果一致；降序由调用方传入取负后的键。
+    键中不应包含 NaN。
+    """
+    keys = [np.asarray(key) for key in keys]
+    n = len(keys[0])
+    k = slice_count(n, k)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        # 主键不大于第 k 小值的行一定覆盖前 k 名（含并列）
+        primary = keys[0]
+        kth = np.partition(primary, k - 1)[k - 1]
+        cand = np.flatnonzero(primary <= kth)
+    else:
+        cand = np.arange(n)
+    order = np.lexsort([cand] + [key[cand] for key in reversed(keys)])
+    return cand[order[:k]]
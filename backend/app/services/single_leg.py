@@ -3,78 +3,39 @@
 """
 from __future__ import annotations
 
-import math
-from typing import Dict, List
+from typing import Dict
 import numpy as np
 import pandas as pd
 
-from .quality import compute_mid, spread_flag
-
-
-def _prep_single_leg_chain(df: pd.DataFrame) -> pd.DataFrame:
-    """准备单腿期权数据链"""
-    req = [
-        "date", "base", "instrument", "expiry_ts", "strike", "option_type",
-        "bid", "ask", "mark_price", "mark_iv", "underlying", "oi", "asof_ts",
-    ]
-    for c in req:
-        if c not in df.columns:
-            df[c] = np.nan
-
-    # 计算 mid 和 quality
-    mids = []
-    qflags = []
-    spread_ratios = []
-    for bid, ask, mark in zip(df["bid"].tolist(), df["ask"].tolist(), df["mark_price"].tolist()):
-        bid = None if (bid is None or (isinstance(bid, float) and math.isnan(bid))) else bid
-        ask = None if (ask is None or (isinstance(ask, float) and math.isnan(ask))) else ask
-        mark = None if (mark is None or (isinstance(mark, float) and math.isnan(mark))) else mark
-
-        mid = compute_mid(bid, ask, mark)
-        mids.append(mid)
-        qflags.append(spread_flag(bid, ask, mid))
-
-        # 计算点差比例
-        if bid and ask and bid > 0 and ask > 0:
-            mid_val = (bid + ask) / 2.0
-            spread_ratio = (ask - bid) / mid_val if mid_val > 0 else float('inf')
-        else:
-            spread_ratio = float('inf')
-        spread_ratios.append(spread_ratio)
-
-    df = df.copy()
-    df["mid"] = mids
-    df["quality_flag"] = qflags
-    df["spread_ratio"] = spread_ratios
-    return df
+from .chain_prep import chain_base, prepare_chain
+from .metrics import record_scan
+from .ranking import top_k_indices
 
 
-def _normalize_score(values: List[float]) -> List[float]:
-    """归一化得分到 0-1 范围"""
-    if not values or len(values) == 0:
-        return []
+def _normalize_score(values) -> np.ndarray:
+    """归一化得分到 0-1 范围（非有限值记 0，全部相等时记 0.5）"""
+    arr = np.asarray(values, dtype=float)
+    if arr.size == 0:
+        return arr
 
-    arr = np.array(values)
     valid_mask = np.isfinite(arr)
-
     if not np.any(valid_mask):
-        return [0.0] * len(values)
+        return np.zeros(len(arr))
 
     valid_values = arr[valid_mask]
     min_val = np.min(valid_values)
     max_val = np.max(valid_values)
 
     if max_val == min_val:
-        return [0.5 if np.isfinite(v) else 0.0 for v in values]
+        return np.where(valid_mask, 0.5, 0.0)
 
-    normalized = []
-    for v in values:
-        if not np.isfinite(v):
-            normalized.append(0.0)
-        else:
-            normalized.append((v - min_val) / (max_val - min_val))
+    with np.errstate(invalid="ignore"):
+        return np.where(valid_mask, (arr - min_val) / (max_val - min_val), 0.0)
 
-    return normalized
+
+def _round_scores(score: np.ndarray) -> np.ndarray:
+    # 与内置 round(x, 1) 保持一致（np.round 在 .x5 边界上的舍入可能不同）
+    return np.array([round(x, 1) for x in score.tolist()])
 
 
 def scan_csp(
@@ -105,127 +66,90 @@ def scan_csp(
     Returns:
         包含候选策略的字典
     """
-    df = _prep_single_leg_chain(chain_df)
+    df = prepare_chain(chain_df, meta)
     asof = int(meta.asof_ts)
     date = meta.date
     spot = meta.spot_price
 
-    # 只保留看跌期权
-    df = df[df["option_type"].str.upper() == "P"].copy()
-    df = df[df["mid"].notna()].copy()
-
-    # 计算 DTE
-    df["dte"] = (df["expiry_ts"] - asof) / (1000 * 60 * 60 * 24)
-
-    # 筛选条件
-    df = df[df["dte"] <= max_dte].copy()
-    df = df[df["dte"] > 0].copy()
-
+    # 只保留看跌期权，按 DTE / OI 筛选
+    mask = df["is_put"] & df["mid"].notna() & (df["dte"] <= max_dte) & (df["dte"] > 0)
     if min_oi > 0:
-        df = df[df["oi"].fillna(0) >= min_oi].copy()
+        mask &= df["oi"].fillna(0) >= min_oi
 
     # 过滤点差过大的期权
-    df["spread_bps"] = df["spread_ratio"] * 10000
-    df = df[df["spread_bps"] <= max_spread_bps].copy()
+    mask &= df["spread_ratio"] * 10000 <= max_spread_bps
+    df = df[mask]
 
     if df.empty:
         return {
             "asof_date": date,
             "asof_ts": asof,
-            "base": meta.base if hasattr(meta, 'base') else chain_df["base"].iloc[0] if not chain_df.empty else "",
+            "base": chain_base(chain_df, meta),
             "spot_price": spot,
             "strategy": "CSP",
             "candidates": []
         }
 
-    # 计算策略指标
-    candidates = []
-
-    for _, row in df.iterrows():
-        strike = float(row["strike"])
-        mid = float(row["mid"])
-        dte = float(row["dte"])
-        oi = float(row["oi"]) if not pd.isna(row["oi"]) else 0
-        spread_bps = float(row["spread_bps"])
-
-        # 估算 delta（对于 Put，delta 为负）
-        # 使用更准确的近似：基于 moneyness 和简化的正态分布
-        moneyness = strike / spot
-
-        # OTM Put (strike < spot): delta 接近 0
-        # ATM Put (strike ≈ spot): delta 接近 -0.5
-        # ITM Put (strike > spot): delta 接近 -1
-        if moneyness < 0.9:  # Deep OTM
-            estimated_delta = -0.1 * (moneyness / 0.9)
-        elif moneyness < 1.0:  # Slightly OTM
-            estimated_delta = -0.1 - 0.4 * ((moneyness - 0.9) / 0.1)
-        elif moneyness < 1.1:  # Slightly ITM
-            estimated_delta = -0.5 - 0.4 * ((moneyness - 1.0) / 0.1)
-        else:  # Deep ITM
-            estimated_delta = -0.9 - 0.09 * min((moneyness - 1.1), 1.0)
-
-        estimated_delta = max(-0.99, min(-0.01, estimated_delta))
-        assign_prob = abs(estimated_delta)
-
-        # 过滤 delta
-        if assign_prob > max_delta:
-            continue
-
-        # 计算策略指标
-        premium = mid * spot  # 权利金（USD）
-        breakeven = strike - mid  # 盈亏平衡点
-        discount_pct = (spot - breakeven) / spot if spot > 0 else 0  # 折扣百分比
-
-        # 检查保证金是否足够
-        # CSP 保证金需求 ≈ strike * 100 (简化)
-        required_margin = strike
-        if required_margin > available_cash:
-            continue
-
-        # APR 计算
-        apr = (premium / strike) * (365.0 / dte) if strike > 0 and dte > 0 else 0
-
-        # 流动性得分（基于 OI 和点差）
-        liquidity_score = math.log1p(oi) / (1 + spread_bps / 100)
-
-        candidates.append({
-            "symbol": row["instrument"],
-            "expiry_ts": int(row["expiry_ts"]),
-            "expiry_date": pd.Timestamp(row["expiry_ts"], unit='ms').strftime('%Y-%m-%d'),
-            "strike": strike,
-            "delta": estimated_delta,
-            "premium": premium,
-            "breakeven": breakeven,
-            "discount_pct": discount_pct,
-            "apr": apr,
-            "assign_prob": assign_prob,
-            "oi": oi,
-            "spread_bps": spread_bps,
-            "dte": dte,
-            "liquidity_score": liquidity_score,
-            "quality": row["quality_flag"],
-        })
-
-    if not candidates:
+    # 计算策略指标（按列计算）
+    strike = df["strike"].to_numpy(dtype=float)
+    mid = df["mid"].to_numpy(dtype=float)
+    dte = df["dte"].to_numpy(dtype=float)
+    oi = df["oi"].fillna(0).to_numpy(dtype=float)
+    oi_missing = df["oi"].isna().to_numpy()  # 缺失的 OI 按原实现输出整数 0
+    spread_bps = df["spread_ratio"].to_numpy(dtype=float) * 10000
+
+    # 估算 delta（对于 Put，delta 为负）
+    # 使用更准确的近似：基于 moneyness 和简化的正态分布
+    # OTM Put (strike < spot): delta 接近 0
+    # ATM Put (strike ≈ spot): delta 接近 -0.5
+    # ITM Put (strike > spot): delta 接近 -1
+    moneyness = strike / spot
+    estimated_delta = np.select(
+        [moneyness < 0.9, moneyness < 1.0, moneyness < 1.1],  # Deep OTM / Slightly OTM / Slightly ITM
+        [
+            -0.1 * (moneyness / 0.9),
+            -0.1 - 0.4 * ((moneyness - 0.9) / 0.1),
+            -0.5 - 0.4 * ((moneyness - 1.0) / 0.1),
+        ],
+        default=-0.9 - 0.09 * np.minimum(moneyness - 1.1, 1.0),  # Deep ITM
+    )
+    estimated_delta = np.maximum(-0.99, np.minimum(-0.01, estimated_delta))
+    assign_prob = np.abs(estimated_delta)
+
+    # 过滤 delta；检查保证金是否足够（CSP 保证金需求 ≈ strike，简化）
+    keep = ~(assign_prob > max_delta) & ~(strike > available_cash)
+
+    if not keep.any():
         return {
             "asof_date": date,
             "asof_ts": asof,
-            "base": df["base"].iloc[0] if not df.empty else "",
+            "base": chain_base(chain_df, meta),
             "spot_price": spot,
             "strategy": "CSP",
             "candidates": []
         }
 
-    # 计算综合得分
-    aprs = [c["apr"] for c in candidates]
-    discounts = [c["discount_pct"] for c in candidates]
-    assign_probs = [c["assign_prob"] for c in candidates]
-    liq_scores = [c["liquidity_score"] for c in candidates]
+    rows = np.flatnonzero(keep)
+    strike, mid, dte, oi, spread_bps = strike[rows], mid[rows], dte[rows], oi[rows], spread_bps[rows]
+    oi_missing = oi_missing[rows]
+    estimated_delta, assign_prob = estimated_delta[rows], assign_prob[rows]
+
+    premium = mid * spot  # 权利金（USD）
+    breakeven = strike - mid  # 盈亏平衡点
+    discount_pct = (spot - breakeven) / spot if spot > 0 else np.zeros(len(rows))  # 折扣百分比
+
+    # APR 计算
+    with np.errstate(divide="ignore", invalid="ignore"):
+        apr = np.where((strike > 0) & (dte > 0), (premium / strike) * (365.0 / dte), 0.0)
+
+    # 流动性得分（基于 OI 和点差）
+    liquidity_score = np.log1p(oi) / (1 + spread_bps / 100)
 
-    norm_apr = _normalize_score(aprs)
-    norm_discount = _normalize_score(discounts)
-    norm_assign = _normalize_score([1.0 - p for p in assign_probs])  # 反转：低行权概率得高分
-    norm_liq = _normalize_score(liq_scores)
+    # 计算综合得分
+    norm_apr = _normalize_score(apr)
+    norm_discount = _normalize_score(discount_pct)
+    norm_assign = _normalize_score(1.0 - assign_prob)  # 反转：低行权概率得高分
+    norm_liq = _normalize_score(liquidity_score)
 
     # 权重配置
     w_apr = 0.35
@@ -233,23 +157,46 @@ def scan_csp(
     w_assign = 0.20
     w_liq = 0.20
 
-    for i, c in enumerate(candidates):
-        score = (
-            w_apr * norm_apr[i] +
-            w_buffer * norm_discount[i] +
-            w_assign * norm_assign[i] +
-            w_liq * norm_liq[i]
-        ) * 100  # 转换为 0-100 分
-        c["score"] = round(score, 1)
+    score = _round_scores((
+        w_apr * norm_apr +
+        w_buffer * norm_discount +
+        w_assign * norm_assign +
+        w_liq * norm_liq
+    ) * 100)  # 转换为 0-100 分
+
+    # 按得分排序（只为前 return_count 个构造结果）
+    symbols = df["instrument"].to_numpy()
+    expiry_ts = df["expiry_ts"].to_numpy()
+    quality = df["quality_flag"].to_numpy()
+    top_candidates = []
+    # 同分按到期日、行权价升序，结果顺序与分区读取顺序无关
+    for i in top_k_indices([-score, expiry_ts[rows], strike], return_count).tolist():
+        r = rows[i]
+        top_candidates.append({
+            "symbol": symbols[r],
+            "expiry_ts": int(expiry_ts[r]),
+            "expiry_date": pd.Timestamp(expiry_ts[r], unit='ms').strftime('%Y-%m-%d'),
+            "strike": float(strike[i]),
+            "delta": float(estimated_delta[i]),
+            "premium": float(premium[i]),
+            "breakeven": float(breakeven[i]),
+            "discount_pct": float(discount_pct[i]),
+            "apr": float(apr[i]),
+            "assign_prob": float(assign_prob[i]),
+            "oi": 0 if oi_missing[i] else float(oi[i]),
+            "spread_bps": float(spread_bps[i]),
+            "dte": float(dte[i]),
+            "liquidity_score": float(liquidity_score[i]),
+            "quality": quality[r],
+            "score": float(score[i]),
+        })
 
-    # 按得分排序
-    candidates.sort(key=lambda x: x["score"], reverse=True)
-    top_candidates = candidates[:return_count]
+    record_scan("csp", 0, len(top_candidates))
 
     return {
         "asof_date": date,
         "asof_ts": asof,
-        "base": df["base"].iloc[0] if not df.empty else "",
+        "base": chain_base(chain_df, meta),
         "spot_price": spot,
         "dvol_index": meta.dvol_index,
         "strategy": "CSP",
@@ -292,120 +239,93 @@ def scan_cc(
     Returns:
         包含候选策略的字典
     """
-    df = _prep_single_leg_chain(chain_df)
+    df = prepare_chain(chain_df, meta)
     asof = int(meta.asof_ts)
     date = meta.date
     spot = meta.spot_price
 
-    # 只保留看涨期权
-    df = df[df["option_type"].str.upper() == "C"].copy()
-    df = df[df["mid"].notna()].copy()
-
-    # 计算 DTE
-    df["dte"] = (df["expiry_ts"] - asof) / (1000 * 60 * 60 * 24)
-
-    # 筛选条件
-    df = df[df["dte"] <= max_dte].copy()
-    df = df[df["dte"] > 0].copy()
-
+    # 只保留看涨期权，按 DTE / OI 筛选
+    mask = df["is_call"] & df["mid"].notna() & (df["dte"] <= max_dte) & (df["dte"] > 0)
     if min_oi > 0:
-        df = df[df["oi"].fillna(0) >= min_oi].copy()
+        mask &= df["oi"].fillna(0) >= min_oi
 
     # 过滤点差过大的期权
-    df["spread_bps"] = df["spread_ratio"] * 10000
-    df = df[df["spread_bps"] <= max_spread_bps].copy()
+    mask &= df["spread_ratio"] * 10000 <= max_spread_bps
+    df = df[mask]
 
     if df.empty:
         return {
             "asof_date": date,
             "asof_ts": asof,
-            "base": meta.base if hasattr(meta, 'base') else chain_df["base"].iloc[0] if not chain_df.empty else "",
+            "base": chain_base(chain_df, meta),
             "spot_price": spot,
             "strategy": "CC",
             "candidates": []
         }
 
-    # 计算策略指标
-    candidates = []
-
-    for _, row in df.iterrows():
-        strike = float(row["strike"])
-        mid = float(row["mid"])
-        dte = float(row["dte"])
-        oi = float(row["oi"]) if not pd.isna(row["oi"]) else 0
-        spread_bps = float(row["spread_bps"])
-
-        # 估算 delta（对于 Call，delta 为正）
-        # 使用更准确的近似：基于 moneyness 和简化的正态分布
-        moneyness = strike / spot
-
-        # OTM Call (strike > spot): delta 接近 0
-        # ATM Call (strike ≈ spot): delta 接近 0.5
-        # ITM Call (strike < spot): delta 接近 1
-        if moneyness > 1.1:  # Deep OTM
-            estimated_delta = 0.1 * (1.1 / moneyness)
-        elif moneyness > 1.0:  # Slightly OTM
-            estimated_delta = 0.1 + 0.4 * ((1.1 - moneyness) / 0.1)
-        elif moneyness > 0.9:  # Slightly ITM
-            estimated_delta = 0.5 + 0.4 * ((1.0 - moneyness) / 0.1)
-        else:  # Deep ITM
-            estimated_delta = 0.9 + 0.09 * min((0.9 - moneyness) / 0.1, 1.0)
-
-        estimated_delta = max(0.01, min(0.99, estimated_delta))
-        assign_prob = estimated_delta
-
-        # 过滤 delta
-        if assign_prob > max_delta:
-            continue
-
-        # 计算策略指标
-        premium = mid * spot * position_size  # 权利金（USD）
-        upside_pct = (strike - spot) / spot if spot > 0 else 0  # 上涨空间
-
-        # APR (基于名义本金)
-        notional = spot * position_size
-        apr_notional = (premium / notional) * (365.0 / dte) if notional > 0 and dte > 0 else 0
-
-        # 流动性得分
-        liquidity_score = math.log1p(oi) / (1 + spread_bps / 100)
-
-        candidates.append({
-            "symbol": row["instrument"],
-            "expiry_ts": int(row["expiry_ts"]),
-            "expiry_date": pd.Timestamp(row["expiry_ts"], unit='ms').strftime('%Y-%m-%d'),
-            "strike": strike,
-            "delta": estimated_delta,
-            "premium": premium,
-            "upside_pct": upside_pct,
-            "apr_notional": apr_notional,
-            "assign_prob": assign_prob,
-            "oi": oi,
-            "spread_bps": spread_bps,
-            "dte": dte,
-            "liquidity_score": liquidity_score,
-            "quality": row["quality_flag"],
-        })
-
-    if not candidates:
+    # 计算策略指标（按列计算）
+    strike = df["strike"].to_numpy(dtype=float)
+    mid = df["mid"].to_numpy(dtype=float)
+    dte = df["dte"].to_numpy(dtype=float)
+    oi = df["oi"].fillna(0).to_numpy(dtype=float)
+    oi_missing = df["oi"].isna().to_numpy()  # 缺失的 OI 按原实现输出整数 0
+    spread_bps = df["spread_ratio"].to_numpy(dtype=float) * 10000
+
+    # 估算 delta（对于 Call，delta 为正）
+    # 使用更准确的近似：基于 moneyness 和简化的正态分布
+    # OTM Call (strike > spot): delta 接近 0
+    # ATM Call (strike ≈ spot): delta 接近 0.5
+    # ITM Call (strike < spot): delta 接近 1
+    moneyness = strike / spot
+    estimated_delta = np.select(
+        [moneyness > 1.1, moneyness > 1.0, moneyness > 0.9],  # Deep OTM / Slightly OTM / Slightly ITM
+        [
+            0.1 * (1.1 / moneyness),
+            0.1 + 0.4 * ((1.1 - moneyness) / 0.1),
+            0.5 + 0.4 * ((1.0 - moneyness) / 0.1),
+        ],
+        default=0.9 + 0.09 * np.minimum((0.9 - moneyness) / 0.1, 1.0),  # Deep ITM
+    )
+    estimated_delta = np.maximum(0.01, np.minimum(0.99, estimated_delta))
+    assign_prob = estimated_delta
+
+    # 过滤 delta
+    keep = ~(assign_prob > max_delta)
+
+    if not keep.any():
         return {
             "asof_date": date,
             "asof_ts": asof,
-            "base": df["base"].iloc[0] if not df.empty else "",
+            "base": chain_base(chain_df, meta),
             "spot_price": spot,
             "strategy": "CC",
             "candidates": []
         }
 
-    # 计算综合得分
-    aprs = [c["apr_notional"] for c in candidates]
-    upsides = [c["upside_pct"] for c in candidates]
-    assign_probs = [c["assign_prob"] for c in candidates]
-    liq_scores = [c["liquidity_score"] for c in candidates]
+    rows = np.flatnonzero(keep)
+    strike, mid, dte, oi, spread_bps = strike[rows], mid[rows], dte[rows], oi[rows], spread_bps[rows]
+    oi_missing = oi_missing[rows]
+    estimated_delta = assign_prob = estimated_delta[rows]
+
+    premium = mid * spot * position_size  # 权利金（USD）
+    upside_pct = (strike - spot) / spot if spot > 0 else np.zeros(len(rows))  # 上涨空间
+
+    # APR (基于名义本金)
+    notional = spot * position_size
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if notional > 0:
+            apr_notional = np.where(dte > 0, (premium / notional) * (365.0 / dte), 0.0)
+        else:
+            apr_notional = np.zeros(len(rows))
 
-    norm_apr = _normalize_score(aprs)
-    norm_upside = _normalize_score(upsides)
-    norm_assign = _normalize_score([1.0 - p for p in assign_probs])  # 反转：低行权概率得高分
-    norm_liq = _normalize_score(liq_scores)
+    # 流动性得分
+    liquidity_score = np.log1p(oi) / (1 + spread_bps / 100)
+
+    # 计算综合得分
+    norm_apr = _normalize_score(apr_notional)
+    norm_upside = _normalize_score(upside_pct)
+    norm_assign = _normalize_score(1.0 - assign_prob)  # 反转：低行权概率得高分
+    norm_liq = _normalize_score(liquidity_score)
 
     # 权重配置
     w_apr = 0.35
@@ -413,23 +333,45 @@ def scan_cc(
     w_assign = 0.20
     w_liq = 0.20
 
-    for i, c in enumerate(candidates):
-        score = (
-            w_apr * norm_apr[i] +
-            w_upcap * norm_upside[i] +
-            w_assign * norm_assign[i] +
-            w_liq * norm_liq[i]
-        ) * 100
-        c["score"] = round(score, 1)
+    score = _round_scores((
+        w_apr * norm_apr +
+        w_upcap * norm_upside +
+        w_assign * norm_assign +
+        w_liq * norm_liq
+    ) * 100)
+
+    # 按得分排序（只为前 return_count 个构造结果）
+    symbols = df["instrument"].to_numpy()
+    expiry_ts = df["expiry_ts"].to_numpy()
+    quality = df["quality_flag"].to_numpy()
+    top_candidates = []
+    # 同分按到期日、行权价升序，结果顺序与分区读取顺序无关
+    for i in top_k_indices([-score, expiry_ts[rows], strike], return_count).tolist():
+        r = rows[i]
+        top_candidates.append({
+            "symbol": symbols[r],
+            "expiry_ts": int(expiry_ts[r]),
+            "expiry_date": pd.Timestamp(expiry_ts[r], unit='ms').strftime('%Y-%m-%d'),
+            "strike": float(strike[i]),
+            "delta": float(estimated_delta[i]),
+            "premium": float(premium[i]),
+            "upside_pct": float(upside_pct[i]),
+            "apr_notional": float(apr_notional[i]),
+            "assign_prob": float(assign_prob[i]),
+            "oi": 0 if oi_missing[i] else float(oi[i]),
+            "spread_bps": float(spread_bps[i]),
+            "dte": float(dte[i]),
+            "liquidity_score": float(liquidity_score[i]),
+            "quality": quality[r],
+            "score": float(score[i]),
+        })
 
-    # 按得分排序
-    candidates.sort(key=lambda x: x["score"], reverse=True)
-    top_candidates = candidates[:return_count]
+    record_scan("cc", 0, len(top_candidates))
 
     return {
         "asof_date": date,
         "asof_ts": asof,
-        "base": df["base"].iloc[0] if not df.empty else "",
+        "base": chain_base(chain_df, meta),
         "spot_price": spot,
         "dvol_index": meta.dvol_index,
         "strategy": "CC",
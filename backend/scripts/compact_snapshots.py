@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+快照分层保留与压缩（取代 cleanup_old_data 的「只留今天」）
+
+- 最近 RETAIN_HOURLY_DAYS 天（含今天，UTC）：保留原始的 dt=YYYY-MM-DD-HH 小时目录
+- 更早、且在 RETAIN_DAILY_MONTHS 个月以内的日期：压缩为一个 dt=YYYY-MM-DD 目录
+    manifest.json           当天最后一个快照的 manifest，另含 compacted.snapshots（各小时的 asof/现货/DVOL）
+    base=X/chain.parquet    当天最后一个快照（合并布局，loader 直接读取）
+    base=X/chain.arrow      同上的 Arrow IPC 副本（ETL_ARROW_KEEP > 0 时写出，供 API memory-map）
+    base=X/history.parquet  其余小时相对后一小时的反向增量：只保存有变化的行，
+                            以及后一小时存在而该小时不存在的合约（removed=True）
+- 更早的日期整体删除
+
+compacted 目录先写入 .staging-*，再原子发布；catalog 随即优先读取压缩目录，但 API 中正在进行的扫描可能仍在读
+小时目录，因此本次运行不删除它们。之后的运行在压缩目录发布满 COMPACT_DELETE_GRACE_S 秒后，
+删除已合并进压缩目录的小时目录；尚未合并的小时目录（中途失败或新出现）会再次合并。
+重新发布已存在的压缩目录时，旧目录改名为 .replaced-* 并同样在宽限期后删除。
+restore_hourly() 可以从压缩目录还原当天每个小时的期权链。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dateutil.relativedelta import relativedelta
+
+from etl_daily import ETL_ARROW_KEEP, write_chain_arrow, write_chain_parquet
+
+
+DATA_ROOT = Path(__file__).parent.parent / "data" / "parquet"
+RETAIN_HOURLY_DAYS = int(os.environ.get("RETAIN_HOURLY_DAYS", 1))
+RETAIN_DAILY_MONTHS = int(os.environ.get("RETAIN_DAILY_MONTHS", 6))
+# 压缩目录发布后多久才删除被它取代的小时目录 / 旧压缩目录（须远大于单次扫描耗时）
+COMPACT_DELETE_GRACE_S = int(os.environ.get("COMPACT_DELETE_GRACE_S", 3600))
+
+# 增量比较与还原使用的字段（scanner 所需的期权链字段）
+KEY_COLUMN = "instrument"
+STATIC_COLUMNS = ["expiry_ts", "strike", "option_type"]
+QUOTE_COLUMNS = ["bid", "ask", "mark_price", "mark_iv", "underlying", "oi"]
+HISTORY_COLUMNS = [KEY_COLUMN, *STATIC_COLUMNS, *QUOTE_COLUMNS, "asof_ts", "removed"]
+
+# 一个快照：(asof_ts, manifest, {base: DataFrame})
+Snapshot = Tuple[int, Dict, Dict[str, pd.DataFrame]]
+
+
+def _read_base(snapshot_dir: Path, base: str) -> Optional[pd.DataFrame]:
+    """读取快照目录下某个 base 的期权链（合并布局或旧的 expiry=* 分区布局）"""
+    base_dir = snapshot_dir / f"base={base}"
+    consolidated = base_dir / "chain.parquet"
+    if consolidated.exists():
+        return pd.read_parquet(consolidated)
+    parts = sorted(base_dir.glob("expiry=*/chain.parquet"))
+    if not parts:
+        return None
+    return pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True)
+
+
+def _snapshot_bases(snapshot_dir: Path, manifest: Dict) -> List[str]:
+    bases = list(manifest.get("bases", []))
+    for p in sorted(snapshot_dir.glob("base=*")):
+        name = p.name.split("=", 1)[1]
+        if name not in bases:
+            bases.append(name)
+    return bases
+
+
+def _read_snapshot(snapshot_dir: Path) -> Optional[Snapshot]:
+    mpath = snapshot_dir / "manifest.json"
+    if not mpath.exists():
+        return None
+    manifest = json.loads(mpath.read_text())
+    frames = {}
+    for base in _snapshot_bases(snapshot_dir, manifest):
+        df = _read_base(snapshot_dir, base)
+        if df is not None:
+            frames[base] = df
+    return int(manifest.get("asof_ts", 0)), manifest, frames
+
+
+def _history_frame(df: pd.DataFrame, asof: int) -> pd.DataFrame:
+    out = pd.DataFrame({c: df[c] if c in df.columns else np.nan for c in [KEY_COLUMN, *STATIC_COLUMNS, *QUOTE_COLUMNS]})
+    for c in QUOTE_COLUMNS + ["strike"]:
+        out[c] = pd.to_numeric(out[c], errors="coerce").astype(float)
+    out["expiry_ts"] = pd.to_numeric(out["expiry_ts"], errors="coerce").fillna(0).astype(np.int64)
+    out["asof_ts"] = np.int64(asof)
+    out["removed"] = False
+    return out.drop_duplicates(KEY_COLUMN, keep="last").reset_index(drop=True)
+
+
+def reverse_delta(earlier: pd.DataFrame, later: pd.DataFrame) -> pd.DataFrame:
+    """earlier 相对 later 的增量：earlier 中新增或字段变化的行 + later 中有而 earlier 中没有的合约（removed）"""
+    merged = earlier.merge(later, on=KEY_COLUMN, how="left", suffixes=("", "_next"), indicator=True)
+    changed = (merged["_merge"] == "left_only").to_numpy()
+    for c in STATIC_COLUMNS + QUOTE_COLUMNS:
+        a, b = merged[c], merged[f"{c}_next"]
+        changed |= ~((a == b) | (a.isna() & b.isna())).to_numpy()
+    delta = earlier[changed]
+
+    # removed 行沿用后一小时的静态字段，保持列类型（expiry_ts 为整数）
+    gone = later.loc[~later[KEY_COLUMN].isin(earlier[KEY_COLUMN]), [KEY_COLUMN, *STATIC_COLUMNS]].copy()
+    gone["asof_ts"] = earlier["asof_ts"].iloc[0] if len(earlier) else np.int64(0)
+    gone["removed"] = True
+    return pd.concat([delta, gone], ignore_index=True)[HISTORY_COLUMNS]
+
+
+def _write_history(history: pd.DataFrame, path: Path) -> None:
+    history = history.sort_values(["asof_ts", "expiry_ts", "option_type", "strike"], kind="stable")
+    table = pa.Table.from_pandas(history, preserve_index=False)
+    tmp = path.with_suffix(".parquet.tmp")
+    pq.write_table(table, tmp, compression="zstd", use_dictionary=[KEY_COLUMN, "option_type"])
+    tmp.replace(path)
+
+
+def restore_hourly(day_dir: Path, base: str) -> Dict[int, pd.DataFrame]:
+    """从压缩目录还原当天每个快照的期权链（HISTORY_COLUMNS 去掉 removed），按 asof_ts 索引"""
+    manifest = json.loads((day_dir / "manifest.json").read_text())
+    last = _read_base(day_dir, base)
+    if last is None:
+        return {}
+    # 最后一个快照缺少该 base 时，chain.parquet 来自当天更早的快照
+    asof = int(manifest.get("compacted", {}).get("chain_asof", {}).get(base, manifest["asof_ts"]))
+    cur = _history_frame(last, asof).drop(columns="removed")
+    out = {asof: cur}
+
+    hpath = day_dir / f"base={base}" / "history.parquet"
+    history = pd.read_parquet(hpath) if hpath.exists() else pd.DataFrame(columns=HISTORY_COLUMNS)
+    # 逐个回退到更早的快照（没有变化的小时增量为空，但仍是一个快照）
+    snapshots = manifest.get("compacted", {}).get("snapshots", [])
+    earlier = sorted((int(e["asof_ts"]) for e in snapshots if base in e.get("bases", [base]) and int(e["asof_ts"]) < asof), reverse=True)
+    for step_asof in earlier:
+        step = history[history["asof_ts"] == step_asof]
+        removed = step.loc[step["removed"].astype(bool), KEY_COLUMN]
+        rows = step.loc[~step["removed"].astype(bool)].drop(columns="removed")
+        keep = cur[~cur[KEY_COLUMN].isin(removed) & ~cur[KEY_COLUMN].isin(rows[KEY_COLUMN])]
+        cur = pd.concat([keep.assign(asof_ts=np.int64(step_asof)), rows], ignore_index=True)
+        cur = cur.sort_values(["expiry_ts", "option_type", "strike"], kind="stable").reset_index(drop=True)
+        out[step_asof] = cur
+    return dict(sorted(out.items()))
+
+
+def _compacted_snapshots(day_dir: Path) -> List[Snapshot]:
+    """已有的 dt=YYYY-MM-DD 目录还原为快照列表（未压缩的旧日目录视为单个快照）"""
+    snap = _read_snapshot(day_dir)
+    if snap is None:
+        return []
+    _, manifest, frames = snap
+    info = manifest.get("compacted")
+    if not info:
+        return [snap]
+
+    restored = {base: restore_hourly(day_dir, base) for base in frames}
+    snaps = []
+    for entry in info["snapshots"]:
+        asof = int(entry["asof_ts"])
+        m = {**manifest, **entry}
+        m.pop("compacted", None)
+        per_base = {base: hours[asof] for base, hours in restored.items() if asof in hours}
+        if asof == int(manifest["asof_ts"]):
+            # 最后一个快照保留全部字段
+            per_base = {b: frames[b] for b in entry.get("bases", frames) if b in frames}
+        snaps.append((asof, m, per_base))
+    return snaps
+
+
+def compact_day(root: Path, date: str, hourly_dirs: List[Path]) -> Optional[Path]:
+    """把某天的小时目录（以及已有的压缩目录）合并为 dt={date}，返回压缩目录"""
+    day_dir = root / f"dt={date}"
+    snaps: Dict[int, Snapshot] = {}
+    if day_dir.exists():
+        for snap in _compacted_snapshots(day_dir):
+            snaps[snap[0]] = snap
+    for d in sorted(hourly_dirs):
+        snap = _read_snapshot(d)
+        if snap is not None:
+            snaps[snap[0]] = snap
+    if not snaps:
+        return None
+
+    ordered = [snaps[k] for k in sorted(snaps)]
+    last_asof, last_manifest, last_frames = ordered[-1]
+    staging = root / f".staging-compact-{date}-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    try:
+        bases = sorted({b for _, _, frames in ordered for b in frames})
+        chain_asof: Dict[str, int] = {}
+        for base in bases:
+            out_dir = staging / f"base={base}"
+            out_dir.mkdir()
+            hist = [(asof, _history_frame(frames[base], asof)) for asof, _, frames in ordered if base in frames]
+            chain_asof[base] = hist[-1][0]
+            if base in last_frames:
+                chain = last_frames[base]
+                later = hist[-1][1]
+                hist = hist[:-1]
+            else:
+                # 最后一个快照没有该 base：以当天最后出现的快照作为完整链
+                chain = hist[-1][1].drop(columns="removed")
+                later = hist.pop()[1]
+            write_chain_parquet(chain, out_dir / "chain.parquet")
+            if ETL_ARROW_KEEP > 0:
+                write_chain_arrow(chain, out_dir / "chain.arrow")
+            deltas = []
+            for _, earlier in reversed(hist):
+                deltas.append(reverse_delta(earlier, later))
+                later = earlier
+            if deltas:
+                _write_history(pd.concat(deltas, ignore_index=True), out_dir / "history.parquet")
+
+        manifest = dict(last_manifest)
+        manifest.pop("compacted", None)
+        manifest["compacted"] = {
+            "compacted_at": int(datetime.now(tz=timezone.utc).timestamp() * 1000),
+            "chain_asof": chain_asof,
+            "snapshots": [
+                {
+                    "timestamp": m.get("timestamp"),
+                    "asof_ts": asof,
+                    "bases": sorted(frames),
+                    "spot_prices": m.get("spot_prices", {}),
+                    "dvol_indices": m.get("dvol_indices", {}),
+                }
+                for asof, m, frames in ordered
+            ],
+        }
+        (staging / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    _publish_day(staging, day_dir)
+    return day_dir
+
+
+def _publish_day(staging: Path, day_dir: Path) -> None:
+    """发布压缩目录。已存在时旧目录先改名为 .replaced-*（宽限期后由 _sweep_replaced 删除）；
+    两次 rename 之间 catalog 回退到当天仍然保留的小时目录"""
+    if day_dir.exists():
+        replaced = day_dir.with_name(f".replaced-{day_dir.name}-{os.getpid()}")
+        shutil.rmtree(replaced, ignore_errors=True)
+        day_dir.rename(replaced)
+        os.utime(replaced)  # 宽限期从替换时刻起算
+    staging.rename(day_dir)
+
+
+def _sweep_replaced(root: Path, grace_s: float) -> None:
+    cutoff = datetime.now(tz=timezone.utc).timestamp() - grace_s
+    for p in root.glob(".replaced-dt=*"):
+        if p.is_dir() and p.stat().st_mtime < cutoff:
+            shutil.rmtree(p, ignore_errors=True)
+
+
+def _manifest_asof(snapshot_dir: Path) -> Optional[int]:
+    try:
+        return int(json.loads((snapshot_dir / "manifest.json").read_text()).get("asof_ts", 0))
+    except (OSError, ValueError):
+        return None
+
+
+def _compacted_info(day_dir: Path) -> Optional[Tuple[int, set]]:
+    """压缩目录的 (compacted_at 毫秒, 已合并快照的 asof_ts 集合)；不存在或不是压缩目录时返回 None"""
+    try:
+        info = json.loads((day_dir / "manifest.json").read_text()).get("compacted")
+    except (OSError, ValueError):
+        return None
+    if not info:
+        return None
+    return int(info.get("compacted_at", 0)), {int(e["asof_ts"]) for e in info.get("snapshots", [])}
+
+
+def _dir_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def compact(root: Path = DATA_ROOT, today: Optional[str] = None, hourly_days: int = RETAIN_HOURLY_DAYS,
+            daily_months: int = RETAIN_DAILY_MONTHS, dry_run: bool = False,
+            grace_s: float = COMPACT_DELETE_GRACE_S) -> None:
+    today_d = datetime.strptime(today, "%Y-%m-%d").date() if today else datetime.now(tz=timezone.utc).date()
+    hourly_cutoff = (today_d - timedelta(days=max(hourly_days, 1) - 1)).isoformat()
+    daily_cutoff = (today_d - relativedelta(months=daily_months)).isoformat()
+    now_ms = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+    if not dry_run:
+        _sweep_replaced(root, grace_s)
+
+    by_date: Dict[str, List[Path]] = {}
+    for p in root.glob("dt=*"):
+        if p.is_dir():
+            timestamp = p.name.split("=", 1)[1]
+            by_date.setdefault(timestamp[:10], []).append(p)
+
+    for date in sorted(by_date):
+        dirs = by_date[date]
+        hourly = [d for d in dirs if len(d.name.split("=", 1)[1]) > 10]
+        if date >= hourly_cutoff:
+            continue
+        if date < daily_cutoff:
+            print(f"[COMPACT] {date}: expired, deleting {len(dirs)} directories")
+            if not dry_run:
+                for d in dirs:
+                    shutil.rmtree(d, ignore_errors=True)
+            continue
+        if not hourly:
+            continue
+
+        # 已合并进压缩目录的小时目录（没有 manifest 的残缺目录无可合并，一并视为已取代）
+        info = _compacted_info(root / f"dt={date}")
+        folded = info[1] if info is not None else set()
+        pending = [d for d in hourly if _manifest_asof(d) is not None and _manifest_asof(d) not in folded]
+        if not pending:
+            if info is None:
+                continue
+            if now_ms - info[0] < grace_s * 1000:
+                print(f"[COMPACT] {date}: {len(hourly)} folded hourly snapshots kept until the grace period ends")
+                continue
+            print(f"[COMPACT] {date}: deleting {len(hourly)} folded hourly snapshots")
+            if not dry_run:
+                for d in hourly:
+                    shutil.rmtree(d, ignore_errors=True)
+            continue
+
+        before = sum(_dir_size(d) for d in dirs)
+        print(f"[COMPACT] {date}: folding {len(pending)} hourly snapshots ({before / 1e6:.1f} MB)")
+        if dry_run:
+            continue
+        # 小时目录留到下次运行（宽限期之后）再删除
+        day_dir = compact_day(root, date, hourly)
+        if day_dir is not None:
+            print(f"[COMPACT] {date}: -> {day_dir.name} ({_dir_size(day_dir) / 1e6:.1f} MB)")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--hourly-days", type=int, default=RETAIN_HOURLY_DAYS, help="Days (incl. today, UTC) kept as hourly snapshots")
+    ap.add_argument("--daily-months", type=int, default=RETAIN_DAILY_MONTHS, help="Months of compacted daily history kept")
+    ap.add_argument("--today", help="YYYY-MM-DD (default today UTC)")
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--grace", type=float, default=COMPACT_DELETE_GRACE_S, help="Seconds a compacted day must be published before the hourly snapshots it folded are deleted")
+    args = ap.parse_args()
+    compact(DATA_ROOT, args.today, args.hourly_days, args.daily_months, args.dry_run, args.grace)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Deribit 公共 API 抓取层（etl_daily 使用）
+
+- 共享一个连接池（可用时启用 HTTP/2），所有请求经同一个并发上限
+- 传输错误 / 429 / 5xx 按带抖动的指数退避重试，429 优先遵循 Retry-After
+- 每次调用记录耗时、状态码与尝试次数
+- record 模式把原始响应写入目录；replay 模式从该目录读取响应，完全离线运行
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import importlib.util
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+# httpx 的 HTTP/2 支持依赖 h2（httpx[http2]），未安装时退回 HTTP/1.1
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+DERIBIT = "https://www.deribit.com/api/v2"
+
+FETCH_MAX_CONCURRENCY = int(os.environ.get("ETL_FETCH_MAX_CONCURRENCY", 8))
+FETCH_RETRIES = int(os.environ.get("ETL_FETCH_RETRIES", 4))
+FETCH_TIMEOUT_S = float(os.environ.get("ETL_FETCH_TIMEOUT_S", 30))
+# 退避：第 n 次重试等待 uniform(0, min(上限, 基数 * 2**n)) 秒
+FETCH_BACKOFF_BASE_S = float(os.environ.get("ETL_FETCH_BACKOFF_BASE_S", 0.5))
+FETCH_BACKOFF_MAX_S = float(os.environ.get("ETL_FETCH_BACKOFF_MAX_S", 8))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def fixture_name(method: str, params: Dict[str, Any]) -> str:
+    """请求对应的 fixture 文件名：方法名 + 参数摘要（参数顺序无关）"""
+    canonical = json.dumps(params, sort_keys=True, default=str)
+    digest = hashlib.sha1(canonical.encode()).hexdigest()[:12]
+    return f"{method.replace('/', '_')}-{digest}.json"
+
+
+class DeribitClient:
+    """带连接池、并发上限、重试与录制/回放的 Deribit 客户端
+
+    用法::
+
+        async with DeribitClient(replay_dir=Path("fixtures")) as client:
+            rows = await client.call("public/get_book_summary_by_currency", {"currency": "BTC", "kind": "option"})
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = FETCH_MAX_CONCURRENCY,
+        retries: int = FETCH_RETRIES,
+        timeout: float = FETCH_TIMEOUT_S,
+        record_dir: Optional[Path] = None,
+        replay_dir: Optional[Path] = None,
+        base_url: str = DERIBIT,
+    ):
+        if record_dir is not None and replay_dir is not None:
+            raise ValueError("record_dir and replay_dir are mutually exclusive")
+        self.retries = retries
+        self.record_dir = record_dir
+        self.replay_dir = replay_dir
+        self.timings: List[Dict[str, Any]] = []
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+        if replay_dir is None:
+            self._client = httpx.AsyncClient(
+                base_url=base_url,
+                http2=HTTP2_AVAILABLE,
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            )
+
+    async def __aenter__(self) -> "DeribitClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def call(self, method: str, params: Dict[str, Any]) -> Any:
+        """调用公共方法并返回响应中的 result 字段"""
+        return (await self.get_json(method, params)).get("result")
+
+    async def get_json(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        if self.replay_dir is not None:
+            return self._replay(method, params)
+
+        async with self._semaphore:
+            started = time.perf_counter()
+            attempt, status = 0, None
+            try:
+                while True:
+                    attempt += 1
+                    try:
+                        r = await self._client.get(f"/{method}", params=params)
+                    except httpx.TransportError:
+                        if attempt > self.retries:
+                            raise
+                        delay = None
+                    else:
+                        status = r.status_code
+                        if status not in RETRY_STATUS or attempt > self.retries:
+                            r.raise_for_status()
+                            payload = r.json()
+                            break
+                        delay = _retry_after(r)
+                    if delay is None:
+                        delay = random.uniform(0, min(FETCH_BACKOFF_MAX_S, FETCH_BACKOFF_BASE_S * 2 ** (attempt - 1)))
+                    await asyncio.sleep(delay)
+            finally:
+                self._record_timing(method, params, status, attempt, started)
+
+        if self.record_dir is not None:
+            self.record_dir.mkdir(parents=True, exist_ok=True)
+            (self.record_dir / fixture_name(method, params)).write_text(json.dumps(payload))
+        return payload
+
+    def _replay(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        path = self.replay_dir / fixture_name(method, params)
+        if not path.exists():
+            raise FileNotFoundError(f"no recorded response for {method} {params}: {path}")
+        payload = json.loads(path.read_text())
+        self._record_timing(method, params, 200, 1, started)
+        return payload
+
+    def _record_timing(self, method: str, params: Dict[str, Any], status: Optional[int], attempts: int, started: float) -> None:
+        self.timings.append({
+            "method": method,
+            "params": params,
+            "status": status,
+            "attempts": attempts,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+
+    def timing_summary(self) -> Dict[str, Any]:
+        elapsed = [t["elapsed_ms"] for t in self.timings]
+        return {
+            "calls": len(self.timings),
+            "retries": sum(t["attempts"] - 1 for t in self.timings),
+            "total_ms": round(sum(elapsed), 1),
+            "max_ms": max(elapsed, default=0.0),
+            "http2": self._client is not None and HTTP2_AVAILABLE,
+        }
+
+
+def _retry_after(r: httpx.Response) -> Optional[float]:
+    value = r.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return min(FETCH_BACKOFF_MAX_S, max(0.0, float(value)))
+    except ValueError:
+        return None
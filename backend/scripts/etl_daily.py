@@ -4,20 +4,38 @@ from __future__ import annotations
 import argparse
 import asyncio
 import json
+import os
+import shutil
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
-import httpx
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from deribit_fetch import DeribitClient
 
 
 DATA_ROOT = Path("data/parquet")
+# 最新快照指针文件名（与 app/services/catalog.py 的 LATEST_POINTER 一致）
+LATEST_POINTER = "LATEST"
+# 秒级快照目录名（dt=YYYY-MM-DD-HHMMSS）：实时 checkpoint，以及同一小时重跑 ETL 时的新目录；
+# 按名字排序时位于同一小时的 dt=YYYY-MM-DD-HH 之后
+SECOND_TIMESTAMP_FORMAT = "%Y-%m-%d-%H%M%S"
+
+# 本地合约目录：每个 base 一个 JSON，只在出现未知合约或超过 INSTRUMENT_CATALOG_MAX_AGE_S 时重新拉取
+INSTRUMENTS_ROOT = Path("data/instruments")
+INSTRUMENT_CATALOG_MAX_AGE_S = int(os.environ.get("ETL_INSTRUMENT_CATALOG_MAX_AGE_S", 24 * 3600))
+INSTRUMENT_FIELDS = ["strike", "option_type", "expiration_timestamp", "base_currency"]
 
+MS_PER_DAY = 24 * 3600 * 1000
 
-DERIBIT = "https://www.deribit.com/api/v2"
+# 只在最新的 ETL_ARROW_KEEP 个快照目录中保留未压缩的 chain.arrow（API 读取的热点），
+# 更早的快照只留 ZSTD parquet；0 表示不写 Arrow 副本
+ETL_ARROW_KEEP = int(os.environ.get("ETL_ARROW_KEEP", 3))
 
 
 def parse_instrument(name: str) -> Tuple[str, int, float, str]:
@@ -33,94 +51,274 @@ def parse_instrument(name: str) -> Tuple[str, int, float, str]:
     return base, 0, strike, opt
 
 
-async def fetch_book_summary(client: httpx.AsyncClient, currency: str) -> List[Dict]:
-    r = await client.get(
-        f"{DERIBIT}/public/get_book_summary_by_currency",
-        params={"currency": currency, "kind": "option"},
-        timeout=30.0,
-    )
-    r.raise_for_status()
-    d = r.json()
-    return d.get("result", [])
+async def fetch_book_summary(client: DeribitClient, currency: str) -> List[Dict]:
+    result = await client.call("public/get_book_summary_by_currency", {"currency": currency, "kind": "option"})
+    return result or []
 
 
-async def fetch_instruments(client: httpx.AsyncClient, currency: str) -> Dict[str, Dict]:
-    r = await client.get(
-        f"{DERIBIT}/public/get_instruments",
-        params={"currency": currency, "kind": "option", "expired": False},
-        timeout=30.0,
-    )
-    r.raise_for_status()
-    ins = r.json().get("result", [])
+async def fetch_instruments(client: DeribitClient, currency: str) -> Dict[str, Dict]:
+    ins = await client.call("public/get_instruments", {"currency": currency, "kind": "option", "expired": False})
     out = {}
-    for it in ins:
+    for it in ins or []:
         out[it["instrument_name"]] = it
     return out
 
 
-async def fetch_index_price(client: httpx.AsyncClient, currency: str) -> float:
+async def fetch_index_price(client: DeribitClient, currency: str) -> float:
     """获取标准的现货指数价格"""
     index_name = f"{currency.lower()}_usd"
-    r = await client.get(
-        f"{DERIBIT}/public/get_index_price",
-        params={"index_name": index_name},
-        timeout=30.0,
+    result = await client.call("public/get_index_price", {"index_name": index_name})
+    return float((result or {}).get("index_price", 0))
+
+
+async def load_instrument_catalog(
+    client: DeribitClient, currency: str, rows: List[Dict], asof_ts: int
+) -> pd.DataFrame:
+    """返回以 instrument_name 为索引的合约元数据（INSTRUMENT_FIELDS）。
+
+    本地目录先剔除已到期合约；book summary 中出现目录里没有的合约或目录过期时才调用
+    get_instruments，并把结果合并回目录。
+    """
+    path = INSTRUMENTS_ROOT / f"{currency}.json"
+    try:
+        cached = json.loads(path.read_text())
+    except (FileNotFoundError, ValueError):
+        cached = {"fetched_at": 0, "instruments": {}}
+
+    instruments = {
+        name: meta for name, meta in cached["instruments"].items()
+        if int(meta.get("expiration_timestamp") or 0) > asof_ts
+    }
+    fetched_at = int(cached["fetched_at"])
+    names = {r.get("instrument_name") for r in rows} - {None}
+    unknown = names - instruments.keys()
+    if unknown or asof_ts - fetched_at > INSTRUMENT_CATALOG_MAX_AGE_S * 1000:
+        fresh = await fetch_instruments(client, currency)
+        instruments.update({name: {k: it.get(k) for k in INSTRUMENT_FIELDS} for name, it in fresh.items()})
+        fetched_at = asof_ts
+
+    if fetched_at != cached["fetched_at"] or len(instruments) != len(cached["instruments"]):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({"fetched_at": fetched_at, "instruments": instruments}))
+        os.replace(tmp, path)
+
+    return pd.DataFrame.from_dict(instruments, orient="index", columns=INSTRUMENT_FIELDS)
+
+
+def enrich_book_summary(df: pd.DataFrame, ins: pd.DataFrame, base: str) -> pd.DataFrame:
+    """重命名 book summary 字段并按 instrument 对齐合约元数据，补 strike / option_type / expiry_ts / base。
+
+    目录中没有的合约退回解析合约名（expiry_ts 记为 0）；_has_meta 标记行是否来自合约目录。
+    """
+    # Expected fields: instrument_name, bid_price, ask_price, mark_price, mark_iv, open_interest, underlying_price, expiration_timestamp, creation_timestamp
+    df = df.rename(
+        columns={
+            "instrument_name": "instrument",
+            "bid_price": "bid",
+            "ask_price": "ask",
+            "open_interest": "oi",
+            "underlying_price": "underlying",
+        }
     )
-    r.raise_for_status()
-    result = r.json().get("result", {})
-    return float(result.get("index_price", 0))
-
-
-async def run_once(date_str: str, bases: List[str]) -> None:
-    DATA_ROOT.mkdir(parents=True, exist_ok=True)
-
+    has_meta = df["instrument"].isin(ins.index).to_numpy()
+    meta = ins.reindex(df["instrument"].to_numpy())
+
+    strikes = meta["strike"].to_numpy(dtype=float, na_value=np.nan)
+    types = np.where(meta["option_type"].astype(str).str.lower().str.startswith("c"), "C", "P").astype(object)
+    expiries = np.zeros(len(df), dtype=np.int64)
+    expiries[has_meta] = meta["expiration_timestamp"].to_numpy()[has_meta].astype(np.int64)
+    bases_parsed = meta["base_currency"].fillna(base).astype(str).to_numpy(dtype=object)
+
+    missing = np.flatnonzero(~has_meta)
+    if len(missing):
+        # Fallback to parsing
+        for i, name in zip(missing, df["instrument"].to_numpy()[missing]):
+            b, _, k, t = parse_instrument(name)
+            strikes[i] = float(k)
+            types[i] = "C" if t.startswith("C") else "P"
+            bases_parsed[i] = b
+
+    df["strike"] = strikes
+    df["option_type"] = types
+    df["expiry_ts"] = expiries
+    df["base"] = bases_parsed
+    df["_has_meta"] = has_meta
+    return df
+
+
+def compute_dvol(df: pd.DataFrame, spot: float, asof_ts: int) -> float | None:
+    """15-60 天到期、strike 在现货 ±15% 以内的期权 mark_iv 均值（放宽范围以适应 Deribit 的到期日分布）"""
+    if "mark_iv" not in df.columns:
+        return None
+    days_to_exp = (df["expiry_ts"] - asof_ts) / MS_PER_DAY
+    strike = df["strike"]
+    mark_iv = pd.to_numeric(df["mark_iv"], errors="coerce")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        atm = (strike - spot).abs() / spot < 0.15
+    mask = df["_has_meta"] & days_to_exp.between(15, 60) & (strike != 0) & atm & (mark_iv > 0)
+    if not mask.any():
+        return None
+    atm_ivs = mark_iv[mask].tolist()
+    return round(sum(atm_ivs) / len(atm_ivs), 2)
+
+
+def write_chain_parquet(df: pd.DataFrame, path: Path) -> None:
+    """写出单个 base 的期权链：ZSTD 压缩，字符串列字典编码，row group 与到期日对齐并带 min/max 统计，
+    读取端可按 expiry_ts / option_type 谓词跳过不需要的 row group"""
+    df = df.sort_values(["expiry_ts", "option_type", "strike"], kind="stable").reset_index(drop=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    dict_cols = [c for c in ("instrument", "base", "option_type", "date") if c in table.column_names]
+
+    expiries = df["expiry_ts"].to_numpy()
+    bounds = np.flatnonzero(np.diff(expiries)) + 1
+    tmp = path.with_suffix(".parquet.tmp")
+    with pq.ParquetWriter(tmp, table.schema, compression="zstd", use_dictionary=dict_cols, write_statistics=True) as writer:
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(df)]):
+            if hi > lo:
+                writer.write_table(table.slice(lo, hi - lo), row_group_size=hi - lo)
+    tmp.replace(path)
+
+
+def write_chain_arrow(df: pd.DataFrame, path: Path) -> None:
+    """写出未压缩的 Arrow IPC 文件供 API 进程 memory-map：所有 worker 通过页缓存共享同一份物理内存。
+
+    按 (option_type, expiry_ts, strike) 排序，使「单一类型 + 到期日区间」在文件中连续，读取端可零拷贝切片；
+    浮点列的空值写为 NaN（无 validity bitmap 的列转 pandas 时可零拷贝）。
+    """
+    df = df.sort_values(["option_type", "expiry_ts", "strike"], kind="stable").reset_index(drop=True)
+    table = pa.Table.from_pandas(df, preserve_index=False).combine_chunks()
+    table = pa.table(
+        [col.fill_null(float("nan")) if pa.types.is_floating(col.type) else col for col in table.columns],
+        names=table.column_names,
+    )
+    tmp = path.with_suffix(".arrow.tmp")
+    with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    tmp.replace(path)
+
+
+def publish_new_snapshot(staging: Path, target: Path, pointer: Dict) -> None:
+    """把 staging 目录发布为一个新的 dt=... 目录，不替换任何已存在的目录（读取方可能正在使用）。
+
+    目标已存在时丢弃 staging 并抛 FileExistsError；只有比当前 LATEST 更新时才切换指针，
+    避免整点 ETL 与实时 checkpoint 并发时把指针拨回旧快照。
+    """
+    if target.exists():
+        shutil.rmtree(staging, ignore_errors=True)
+        raise FileExistsError(target)
+    staging.rename(target)
+    current = read_latest_pointer(target.parent)
+    if current is None or int(current.get("asof_ts", 0)) < pointer["asof_ts"]:
+        write_latest_pointer(target.parent, pointer)
+
+
+def read_latest_pointer(root: Path) -> Optional[Dict]:
+    try:
+        return json.loads((root / LATEST_POINTER).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def write_latest_pointer(root: Path, pointer: Dict) -> None:
+    tmp = root / f".{LATEST_POINTER}.tmp-{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(pointer, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, root / LATEST_POINTER)
+
+
+def prune_arrow_copies(root: Path, keep: int) -> None:
+    """删除最新 keep 个小时 / checkpoint 快照以外的 chain.arrow（读取端找不到 Arrow 副本时回退到 parquet）。
+
+    压缩后的 dt=YYYY-MM-DD 目录每天只有一个，是 API 读取历史日期时使用的目录，保留其副本。
+    """
+    snapshots = sorted(p for p in root.glob("dt=*") if p.is_dir() and len(p.name) > len("dt=YYYY-MM-DD"))
+    for snapshot in snapshots[:-keep] if keep > 0 else snapshots:
+        for path in snapshot.glob("base=*/chain.arrow"):
+            path.unlink(missing_ok=True)
+
+
+def _sweep_stale_staging(root: Path, max_age_s: float = 3600) -> None:
+    """删除被中断的运行遗留的 staging 目录"""
+    cutoff = datetime.now(tz=timezone.utc).timestamp() - max_age_s
+    for p in root.glob(".staging-*"):
+        if p.is_dir() and p.stat().st_mtime < cutoff:
+            shutil.rmtree(p, ignore_errors=True)
+
+
+async def run_once(
+    date_str: str,
+    bases: List[str],
+    record_dir: Optional[Path] = None,
+    replay_dir: Optional[Path] = None,
+) -> None:
     # 使用完整的时间戳命名：dt=YYYY-MM-DD-HH
     now_utc = datetime.now(tz=timezone.utc)
     asof_ts = int(now_utc.timestamp() * 1000)
-    timestamp_str = now_utc.strftime("%Y-%m-%d-%H")
-    dt_dir = DATA_ROOT / f"dt={timestamp_str}"
-    dt_dir.mkdir(parents=True, exist_ok=True)
 
-    async with httpx.AsyncClient() as client:
-        tasks = [fetch_book_summary(client, b) for b in bases]
-        book_by_base = await asyncio.gather(*tasks)
+    async with DeribitClient(record_dir=record_dir, replay_dir=replay_dir) as client:
+        frames, spot_prices = await _fetch_chains(client, bases, asof_ts)
+
+    # 计算DVOL（30天左右ATM期权的平均IV）
+    dvol_indices = {
+        base: compute_dvol(df, spot_prices[base], asof_ts) for base, df in frames.items()
+    }
+    manifest = save_snapshot(now_utc, date_str, bases, frames, spot_prices, dvol_indices)
+
+    for t in client.timings:
+        print(f"[FETCH] {t['method']} {t['params']} status={t['status']} attempts={t['attempts']} {t['elapsed_ms']}ms")
+    print(json.dumps({"date": date_str, "rows": manifest["rows"], "bases": bases, "fetch": client.timing_summary()}, indent=2))
 
-        ins_tasks = [fetch_instruments(client, b) for b in bases]
-        ins_by_base = await asyncio.gather(*ins_tasks)
 
+async def _fetch_chains(client: DeribitClient, bases: List[str], asof_ts: int) -> Tuple[Dict[str, pd.DataFrame], Dict[str, float]]:
+    # 所有币种的 book summary 与指数价格同时发出，由 client 统一限流
+    book_by_base, index_prices = await asyncio.gather(
+        asyncio.gather(*[fetch_book_summary(client, b) for b in bases]),
         # 获取标准现货指数价格
-        index_tasks = [fetch_index_price(client, b) for b in bases]
-        index_prices = await asyncio.gather(*index_tasks)
-        spot_prices = dict(zip(bases, index_prices))
+        asyncio.gather(*[fetch_index_price(client, b) for b in bases]),
+    )
+    spot_prices = dict(zip(bases, index_prices))
 
-    # 计算DVOL（30天左右ATM期权的平均IV）
-    # 需要使用 ins_by_base 来获取 strike 和 expiration_timestamp
-    dvol_indices = {}
-    for base, rows, ins_map, spot in zip(bases, book_by_base, ins_by_base, index_prices):
-        if not rows:
-            continue
-        # 筛选15-60天到期的ATM期权（放宽范围以适应Deribit的到期日分布）
-        atm_ivs = []
-        for opt in rows:
-            instrument_name = opt.get("instrument_name")
-            meta = ins_map.get(instrument_name) if instrument_name else None
-            if not meta:
-                continue
-
-            exp_ts = int(meta.get("expiration_timestamp", 0))
-            strike = float(meta.get("strike", 0))
-            mark_iv = opt.get("mark_iv")
-
-            days_to_exp = (exp_ts - asof_ts) / (24 * 3600 * 1000)
-            # 15-60天到期，且strike在现货价格±15%以内（ATM附近）
-            if 15 <= days_to_exp <= 60 and strike and abs(strike - spot) / spot < 0.15:
-                if mark_iv and mark_iv > 0:
-                    atm_ivs.append(mark_iv)
-
-        if atm_ivs:
-            dvol_indices[base] = round(sum(atm_ivs) / len(atm_ivs), 2)
-        else:
-            dvol_indices[base] = None
+    # 合约元数据来自本地目录，只有出现未知合约或目录过期时才重新拉取
+    ins_by_base = await asyncio.gather(*[
+        load_instrument_catalog(client, b, rows, asof_ts) for b, rows in zip(bases, book_by_base)
+    ])
+
+    frames = {
+        base: enrich_book_summary(pd.DataFrame(rows), ins_frame, base)
+        for base, rows, ins_frame in zip(bases, book_by_base, ins_by_base)
+        if rows
+    }
+    return frames, spot_prices
+
+
+def save_snapshot(
+    now_utc: datetime,
+    date_str: str,
+    bases: List[str],
+    frames: Dict[str, pd.DataFrame],
+    spot_prices: Dict[str, float],
+    dvol_indices: Dict[str, float | None],
+    timestamp_format: str = "%Y-%m-%d-%H",
+) -> Dict:
+    """把各 base 的期权链写入隐藏的 staging 目录（不匹配 dt=*），写完后原子发布为新目录 dt={timestamp}。
+
+    frames 为 enrich_book_summary 的输出；返回写出的 manifest。
+    从不替换已存在的目录（读取方可能正在使用）：同一小时重跑时改用秒级目录名，
+    旧目录保留，由 LATEST 指针与目录排序切换到新快照（见 publish_new_snapshot）。
+    """
+    DATA_ROOT.mkdir(parents=True, exist_ok=True)
+    _sweep_stale_staging(DATA_ROOT)
+
+    asof_ts = int(now_utc.timestamp() * 1000)
+    timestamp_str = now_utc.strftime(timestamp_format)
+    if (DATA_ROOT / f"dt={timestamp_str}").exists():
+        timestamp_str = now_utc.strftime(SECOND_TIMESTAMP_FORMAT)
+    dt_dir = DATA_ROOT / f"dt={timestamp_str}"
+    staging_dir = DATA_ROOT / f".staging-{timestamp_str}-{os.getpid()}"
+    staging_dir.mkdir(parents=True, exist_ok=True)
 
     manifest = {
         "date": date_str,
@@ -133,78 +331,47 @@ async def run_once(date_str: str, bases: List[str]) -> None:
         "dvol_indices": dvol_indices
     }
 
-    total_rows = 0
-    for base, rows, ins_map in zip(bases, book_by_base, ins_by_base):
-        if not rows:
-            continue
-        df = pd.DataFrame(rows)
-        # Normalize fields presence
-        # Expected fields: instrument_name, bid_price, ask_price, mark_price, mark_iv, open_interest, underlying_price, expiration_timestamp, creation_timestamp
-        df = df.rename(
-            columns={
-                "instrument_name": "instrument",
-                "bid_price": "bid",
-                "ask_price": "ask",
-                "open_interest": "oi",
-                "underlying_price": "underlying",
-            }
-        )
-        # Enrich with instrument metadata: expiry_ts, strike, option_type
-        strikes: List[float] = []
-        types: List[str] = []
-        expiries: List[int] = []
-        bases_parsed: List[str] = []
-        for name in df["instrument"].tolist():
-            meta = ins_map.get(name)
-            if meta:
-                strikes.append(float(meta.get("strike")))
-                types.append("C" if str(meta.get("option_type", "")).lower().startswith("c") else "P")
-                expiries.append(int(meta.get("expiration_timestamp")))
-                bases_parsed.append(str(meta.get("base_currency", base)))
-            else:
-                # Fallback to parsing
-                b, _, k, t = parse_instrument(name)
-                strikes.append(float(k))
-                types.append("C" if t.startswith("C") else "P")
-                expiries.append(0)
-                bases_parsed.append(b)
-        df["strike"] = strikes
-        df["option_type"] = types
-        df["expiry_ts"] = expiries
-        df["base"] = bases_parsed
-        df["date"] = date_str
-        df["asof_ts"] = asof_ts
-
-        # Partition by expiry
-        exp_map: Dict[int, pd.DataFrame] = {}
-        for exp_ts, grp in df.groupby("expiry_ts"):
-            exp_map[int(exp_ts)] = grp
-
-        # Write parquet partitions
-        for exp_ts, grp in exp_map.items():
-            out_dir = dt_dir / f"base={base}" / f"expiry={int(exp_ts)}"
+    try:
+        total_rows = 0
+        for base, df in frames.items():
+            df = df.drop(columns="_has_meta")
+            df["date"] = date_str
+            df["asof_ts"] = asof_ts
+
+            # 每个 base 写一个按 (expiry_ts, option_type, strike) 排序的文件，每个到期日一个 row group
+            out_dir = staging_dir / f"base={base}"
             out_dir.mkdir(parents=True, exist_ok=True)
-            (out_dir / "chain.parquet").unlink(missing_ok=True)
-            grp.to_parquet(out_dir / "chain.parquet", index=False)
+            write_chain_parquet(df, out_dir / "chain.parquet")
+            if ETL_ARROW_KEEP > 0:
+                write_chain_arrow(df, out_dir / "chain.arrow")
 
-        manifest["expiries"][base] = sorted(list(exp_map.keys()))
-        total_rows += int(df.shape[0])
+            manifest["expiries"][base] = sorted(int(x) for x in df["expiry_ts"].unique())
+            total_rows += int(df.shape[0])
 
-    manifest["rows"] = total_rows
-    (dt_dir / "manifest.json").write_text(json.dumps(manifest, indent=2))
-    print(json.dumps({"date": date_str, "rows": total_rows, "bases": bases}, indent=2))
+        manifest["rows"] = total_rows
+        (staging_dir / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    pointer = {"dir": dt_dir.name, "date": timestamp_str[:10], "asof_ts": asof_ts}
+    publish_new_snapshot(staging_dir, dt_dir, pointer)
+    prune_arrow_copies(DATA_ROOT, ETL_ARROW_KEEP)
+    return manifest
 
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--date", help="YYYY-MM-DD (default today UTC)")
     ap.add_argument("--bases", nargs="*", default=["BTC", "ETH"], help="Bases to fetch")
+    fixtures = ap.add_mutually_exclusive_group()
+    fixtures.add_argument("--record", type=Path, metavar="DIR", help="Save raw API responses to DIR")
+    fixtures.add_argument("--replay", type=Path, metavar="DIR", help="Serve API responses from DIR (no network)")
     args = ap.parse_args()
 
     date_str = args.date
     if not date_str:
         date_str = datetime.now(tz=timezone.utc).strftime("%Y-%m-%d")
-    asyncio.run(run_once(date_str, bases=args.bases))
+    asyncio.run(run_once(date_str, bases=args.bases, record_dir=args.record, replay_dir=args.replay))
 
 
 if __name__ == "__main__":
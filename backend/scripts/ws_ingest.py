@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Deribit WebSocket 实时行情接入：维护内存中的实时期权链，并定期写出与 etl_daily 相同格式的快照
+
+- 启动时通过同一 WebSocket 调用 get_instruments / get_book_summary_by_currency / get_index_price 建立初始状态，
+  之后只订阅 ticker.{instrument}.{interval} 与 deribit_price_index.{base}_usd，不再轮询 REST
+- 每 WS_CHECKPOINT_INTERVAL_S 秒把有变化的链经 etl_daily.save_snapshot 发布到新的 dt=YYYY-MM-DD-HHMMSS 目录
+  并切换 LATEST 指针，API 进程无需任何改动即可读到秒级新鲜的数据。checkpoint 从不替换已有目录
+  （读取方可能正在使用，也不与整点 ETL 的 dt=YYYY-MM-DD-HH 冲突）；旧 checkpoint 只保留最近
+  WS_CHECKPOINT_KEEP 个及每小时最后一个（供 compact_snapshots 压缩为历史）
+- 断线后按指数退避重连；WS_INSTRUMENT_REFRESH_S 秒刷新一次合约列表并订阅新上市合约
+
+--url 可指向本地替身服务器用于测试。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import websockets
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import etl_daily  # noqa: E402
+from app.services.live import LiveChain  # noqa: E402
+
+
+WS_URL = os.environ.get("DERIBIT_WS_URL", "wss://www.deribit.com/ws/api/v2")
+# ticker 推送间隔：100ms / agg2（raw 需要鉴权）
+WS_TICKER_INTERVAL = os.environ.get("WS_TICKER_INTERVAL", "100ms")
+WS_CHECKPOINT_INTERVAL_S = float(os.environ.get("WS_CHECKPOINT_INTERVAL_S", 60))
+WS_INSTRUMENT_REFRESH_S = float(os.environ.get("WS_INSTRUMENT_REFRESH_S", 3600))
+WS_SUBSCRIBE_BATCH = int(os.environ.get("WS_SUBSCRIBE_BATCH", 200))
+WS_HEARTBEAT_S = int(os.environ.get("WS_HEARTBEAT_S", 30))
+WS_RPC_TIMEOUT_S = float(os.environ.get("WS_RPC_TIMEOUT_S", 30))
+WS_RECONNECT_MAX_S = float(os.environ.get("WS_RECONNECT_MAX_S", 30))
+WS_CHECKPOINT_KEEP = int(os.environ.get("WS_CHECKPOINT_KEEP", 3))
+
+# checkpoint 目录的时间戳格式（dt=YYYY-MM-DD-HHMMSS）
+CHECKPOINT_TIMESTAMP_FORMAT = etl_daily.SECOND_TIMESTAMP_FORMAT
+CHECKPOINT_TIMESTAMP_LEN = len("YYYY-MM-DD-HHMMSS")
+
+
+class DeribitRPCError(Exception):
+    """Deribit 对 JSON-RPC 调用返回了 error（订阅 / 拉取合约失败等）；run() 按断线处理，退避后重连"""
+
+
+class DeribitStream:
+    """单条 WebSocket 连接上的 JSON-RPC 调用 + 订阅分发"""
+
+    def __init__(self, url: str, bases: List[str], chain: LiveChain):
+        self.url = url
+        self.bases = bases
+        self.chain = chain
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ws = None
+        self._subscribed: set = set()
+        self._failures = 0
+
+    async def run(self) -> None:
+        """保持连接；断线或 RPC 失败后指数退避重连并重新建立订阅（连续失败计数在初始化成功后清零）"""
+        while True:
+            try:
+                async with websockets.connect(self.url, max_size=None) as ws:
+                    await self._session(ws)
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException, DeribitRPCError) as e:
+                self._failures += 1
+                delay = random.uniform(0, min(WS_RECONNECT_MAX_S, 0.5 * 2 ** self._failures))
+                print(f"[WS] connection lost ({e!r}), reconnecting in {delay:.1f}s", flush=True)
+                await asyncio.sleep(delay)
+
+    async def _session(self, ws) -> None:
+        self._ws = ws
+        self._subscribed = set()
+        reader = asyncio.create_task(self._read(ws))
+        try:
+            await self.rpc("public/set_heartbeat", {"interval": WS_HEARTBEAT_S})
+            await asyncio.gather(*[self._bootstrap(base) for base in self.bases])
+            print(f"[WS] subscribed {len(self._subscribed)} channels", flush=True)
+            self._failures = 0
+            while not reader.done():
+                done, _ = await asyncio.wait({reader}, timeout=WS_INSTRUMENT_REFRESH_S)
+                if not done:
+                    await asyncio.gather(*[self._refresh_instruments(base) for base in self.bases])
+            reader.result()
+        finally:
+            reader.cancel()
+            for fut in self._pending.values():
+                fut.cancel()
+            self._pending.clear()
+
+    async def _bootstrap(self, base: str) -> None:
+        await self._refresh_instruments(base)
+        rows, index = await asyncio.gather(
+            self.rpc("public/get_book_summary_by_currency", {"currency": base, "kind": "option"}),
+            self.rpc("public/get_index_price", {"index_name": f"{base.lower()}_usd"}),
+        )
+        self.chain.apply_book_summary(base, rows or [])
+        self.chain.set_index_price(base, float((index or {}).get("index_price", 0)))
+        await self._subscribe([f"deribit_price_index.{base.lower()}_usd"])
+
+    async def _refresh_instruments(self, base: str) -> None:
+        ins = await self.rpc("public/get_instruments", {"currency": base, "kind": "option", "expired": False})
+        self.chain.set_instruments(base, ins or [])
+        await self._subscribe([f"ticker.{name}.{WS_TICKER_INTERVAL}" for name in self.chain.instruments(base)])
+
+    async def _subscribe(self, channels: List[str]) -> None:
+        channels = [c for c in channels if c not in self._subscribed]
+        for i in range(0, len(channels), WS_SUBSCRIBE_BATCH):
+            batch = channels[i:i + WS_SUBSCRIBE_BATCH]
+            accepted = await self.rpc("public/subscribe", {"channels": batch})
+            self._subscribed.update(accepted or batch)
+
+    async def rpc(self, method: str, params: Dict[str, Any]) -> Any:
+        msg_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[msg_id] = fut
+        await self._ws.send(json.dumps({"jsonrpc": "2.0", "id": msg_id, "method": method, "params": params}))
+        try:
+            return await asyncio.wait_for(fut, WS_RPC_TIMEOUT_S)
+        finally:
+            self._pending.pop(msg_id, None)
+
+    async def _read(self, ws) -> None:
+        try:
+            await self._dispatch(ws)
+        finally:
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError("websocket closed"))
+        raise ConnectionError("websocket closed by server")
+
+    async def _dispatch(self, ws) -> None:
+        async for raw in ws:
+            msg = json.loads(raw)
+            if "id" in msg and msg["id"] in self._pending:
+                fut = self._pending[msg["id"]]
+                if fut.done():
+                    continue
+                if "error" in msg:
+                    fut.set_exception(DeribitRPCError(f"deribit error: {msg['error']}"))
+                else:
+                    fut.set_result(msg.get("result"))
+                continue
+
+            method = msg.get("method")
+            params = msg.get("params") or {}
+            if method == "subscription":
+                self._on_notification(params.get("channel", ""), params.get("data") or {})
+            elif method == "heartbeat" and params.get("type") == "test_request":
+                await ws.send(json.dumps({"jsonrpc": "2.0", "id": next(self._ids), "method": "public/test", "params": {}}))
+
+    def _on_notification(self, channel: str, data: Dict[str, Any]) -> None:
+        if channel.startswith("ticker."):
+            self.chain.apply_ticker(data)
+        elif channel.startswith("deribit_price_index."):
+            base = str(data.get("index_name", "")).split("_", 1)[0].upper()
+            if base and data.get("price") is not None:
+                self.chain.set_index_price(base, data["price"], data.get("timestamp"))
+
+
+def checkpoint(chain: LiveChain, bases: List[str]) -> Optional[Dict]:
+    """把实时链写成一个快照目录（与 etl_daily 相同格式）；返回 manifest，无数据时返回 None"""
+    frames, spot_prices, dvol_indices = {}, {}, {}
+    asof = 0
+    for base in bases:
+        df, meta = chain.snapshot(base)
+        if df.empty:
+            continue
+        asof = max(asof, meta.asof_ts)
+        spot_prices[base] = meta.spot_price
+        df = df.assign(_has_meta=True)
+        dvol_indices[base] = etl_daily.compute_dvol(df, meta.spot_price or 0.0, meta.asof_ts)
+        chain.set_dvol(base, dvol_indices[base])
+        frames[base] = df
+    if not frames:
+        return None
+    now_utc = datetime.fromtimestamp(asof / 1000, tz=timezone.utc)
+    manifest = etl_daily.save_snapshot(
+        now_utc, now_utc.strftime("%Y-%m-%d"), bases, frames, spot_prices, dvol_indices,
+        timestamp_format=CHECKPOINT_TIMESTAMP_FORMAT,
+    )
+    prune_checkpoints(etl_daily.DATA_ROOT, WS_CHECKPOINT_KEEP)
+    return manifest
+
+
+def prune_checkpoints(root: Path, keep: int) -> None:
+    """删除旧的 checkpoint 目录：保留最近 keep 个、每小时最后一个以及 LATEST 指向的目录"""
+    checkpoints = sorted(
+        p for p in root.glob("dt=*")
+        if p.is_dir() and len(p.name.split("=", 1)[1]) == CHECKPOINT_TIMESTAMP_LEN
+    )
+    protected = set(checkpoints[-keep:]) if keep > 0 else set()
+    last_of_hour: Dict[str, Path] = {}
+    for p in checkpoints:
+        last_of_hour[p.name[:len("dt=YYYY-MM-DD-HH")]] = p
+    protected.update(last_of_hour.values())
+    pointer = etl_daily.read_latest_pointer(root)
+    if pointer is not None:
+        protected.add(root / str(pointer.get("dir")))
+    for p in checkpoints:
+        if p not in protected:
+            shutil.rmtree(p, ignore_errors=True)
+
+
+async def checkpoint_loop(chain: LiveChain, bases: List[str], interval: float) -> None:
+    last_versions: Dict[str, int] = {}
+    while True:
+        await asyncio.sleep(interval)
+        versions = {b: chain.version(b) for b in bases}
+        if versions == last_versions:
+            continue
+        try:
+            manifest = await asyncio.to_thread(checkpoint, chain, bases)
+        except Exception as e:  # 写盘失败不影响行情接入，下个周期重试
+            print(f"[WS] checkpoint failed: {e!r}", flush=True)
+            continue
+        # set_dvol 会推进版本号，记录写盘后的版本以免无变化时重复写出
+        last_versions = {b: chain.version(b) for b in bases}
+        if manifest is not None:
+            print(f"[WS] checkpoint {manifest['timestamp']} asof={manifest['asof_ts']} rows={manifest['rows']}", flush=True)
+
+
+async def main_async(url: str, bases: List[str], interval: float) -> None:
+    chain = LiveChain()
+    stream = DeribitStream(url, bases, chain)
+    await asyncio.gather(stream.run(), checkpoint_loop(chain, bases, interval))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--bases", nargs="*", default=["BTC", "ETH"], help="Bases to stream")
+    ap.add_argument("--url", default=WS_URL, help="WebSocket endpoint (default Deribit mainnet)")
+    ap.add_argument("--checkpoint-interval", type=float, default=WS_CHECKPOINT_INTERVAL_S, help="Seconds between snapshot checkpoints")
+    args = ap.parse_args()
+    asyncio.run(main_async(args.url, args.bases, args.checkpoint_interval))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+测试夹具：在临时目录生成确定性的合成快照，并把 API 的数据根目录指向它
+
+快照支持三种布局（与线上历史数据一致）：
+- partitioned: 旧布局 base=*/expiry=*/chain.parquet
+- consolidated: etl_daily 的每 base 一个排序、ZSTD 压缩的 chain.parquet
+- arrow: consolidated + memory-map 用的 chain.arrow
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import etl_daily
+from app.api import response_cache
+from app.api.response_cache import clear_response_cache
+from app.services import catalog, loader
+from app.services.chain_prep import clear_prepared_cache
+
+
+DATE = "2025-10-09"
+ASOF_TS = 1760000000000  # 2025-10-09 08:53:20 UTC
+SPOT_PRICES = {"BTC": 60000.0, "ETH": 3000.0}
+DVOL_INDICES = {"BTC": 50.1, "ETH": 60.2}
+STRIKE_STEPS = {"BTC": 1000.0, "ETH": 50.0}
+# 含 7 天内的到期日；NO_EARLY_DTES 用于「裁剪后为空」的场景
+DTES = [0.3, 2, 5, 9, 16, 23, 30, 44, 58, 72, 100, 135, 170, 240, 330]
+NO_EARLY_DTES = [d for d in DTES if d > 7.5]
+LAYOUTS = ["partitioned", "consolidated", "arrow"]
+
+MS_PER_DAY = 1000 * 60 * 60 * 24
+
+
+def make_chain(base: str, spot: float, asof: int, dtes: Iterable[float], seed: int = 0) -> pd.DataFrame:
+    """生成一个 base 的期权链（loader 的 CHAIN_COLUMNS），包含缺失报价、交叉报价、零 bid 等脏数据"""
+    rng = np.random.default_rng(seed)
+    step = STRIKE_STEPS[base]
+    frames = []
+    for dte in dtes:
+        exp = asof + int(dte * MS_PER_DAY)
+        n = 30 if dte > 60 else 20
+        strikes = (np.arange(-n, n + 1) * step + round(spot / step) * step).astype(float)
+        strikes = strikes[strikes > 0]
+        for option_type in "CP":
+            k = strikes
+            intrinsic = np.maximum(spot - k, 0) if option_type == "C" else np.maximum(k - spot, 0)
+            time_value = spot * 0.4 * np.sqrt(dte / 365) * np.exp(-((k - spot) / (spot * 0.3)) ** 2)
+            mark = np.maximum(np.round((intrinsic + time_value) / spot, 4), 0.0001)
+            bid = np.round(mark * (1 - np.abs(rng.normal(0, 0.08, len(k)))), 4)
+            ask = np.round(mark * (1 + np.abs(rng.normal(0, 0.08, len(k)))), 4)
+            r = rng.random(len(k))
+            bid[r < 0.08] = np.nan
+            ask[(r >= 0.08) & (r < 0.12)] = np.nan
+            both = (r >= 0.12) & (r < 0.14)
+            bid[both] = ask[both] = np.nan
+            crossed = (r >= 0.14) & (r < 0.15)
+            bid[crossed], ask[crossed] = ask[crossed], bid[crossed]
+            bid[(r >= 0.15) & (r < 0.16)] = 0.0
+            tie = (r >= 0.16) & (r < 0.17)
+            bid[tie] = ask[tie] = mark[tie]
+            mark_price = np.where(rng.random(len(k)) < 0.03, np.nan, mark)
+            day = pd.Timestamp(exp, unit="ms").strftime("%d%b%y").upper()
+            frames.append(pd.DataFrame({
+                "instrument": [f"{base}-{day}-{int(x)}-{option_type}" for x in k],
+                "bid": bid,
+                "ask": ask,
+                "mark_price": mark_price,
+                "mark_iv": 50 + rng.normal(0, 5, len(k)),
+                "oi": rng.integers(0, 500, len(k)).astype(float),
+                "underlying": spot * (1 + rng.normal(0, 0.0005, len(k))),
+                "volume": 1.0,
+                "creation_timestamp": asof,
+                "estimated_delivery_price": spot,
+                "strike": k,
+                "option_type": option_type,
+                "expiry_ts": exp,
+                "base": base,
+            }))
+    df = pd.concat(frames, ignore_index=True)
+    df["date"] = pd.Timestamp(asof, unit="ms").strftime("%Y-%m-%d")
+    df["asof_ts"] = asof
+    return df
+
+
+def write_snapshot(
+    root: Path,
+    layout: str,
+    dtes: Iterable[float] = DTES,
+    spot_prices: Optional[Dict[str, float]] = SPOT_PRICES,
+    asof: int = ASOF_TS,
+    name: Optional[str] = None,
+    seed: int = 0,
+) -> Path:
+    """写出一个 dt=* 快照目录并返回其路径；spot_prices 为 None 时 manifest 不带现货价"""
+    dtes = list(dtes)
+    timestamp = name or pd.Timestamp(asof, unit="ms").strftime("%Y-%m-%d-%H")
+    snap = root / f"dt={timestamp}"
+    manifest = {
+        "date": timestamp[:10],
+        "timestamp": timestamp,
+        "asof_ts": asof,
+        "bases": list(SPOT_PRICES),
+        "rows": 0,
+        "expiries": {},
+        "spot_prices": spot_prices or {},
+        "dvol_indices": DVOL_INDICES,
+    }
+    for i, (base, spot) in enumerate(SPOT_PRICES.items()):
+        df = make_chain(base, spot, asof, dtes, seed=seed * len(SPOT_PRICES) + i)
+        base_dir = snap / f"base={base}"
+        base_dir.mkdir(parents=True)
+        if layout == "partitioned":
+            for exp, group in df.groupby("expiry_ts"):
+                (base_dir / f"expiry={exp}").mkdir()
+                group.to_parquet(base_dir / f"expiry={exp}" / "chain.parquet", index=False)
+        else:
+            etl_daily.write_chain_parquet(df, base_dir / "chain.parquet")
+            if layout == "arrow":
+                etl_daily.write_chain_arrow(df, base_dir / "chain.arrow")
+        manifest["expiries"][base] = sorted(int(x) for x in df["expiry_ts"].unique())
+        manifest["rows"] += len(df)
+    (snap / "manifest.json").write_text(json.dumps(manifest))
+    return snap
+
+
+def read_full_chain(snap: Path, base: str):
+    """按基线 loader 的方式读取整条链（全部 parquet 文件，不裁剪、不投影），meta 不带 base / spot_fallback"""
+    paths = sorted((snap / f"base={base}").rglob("chain.parquet"))
+    df = pd.concat([pd.read_parquet(p) for p in paths], ignore_index=True)
+    manifest = json.loads((snap / "manifest.json").read_text())
+    meta = loader.ChainMeta(
+        date=manifest["date"],
+        asof_ts=int(manifest["asof_ts"]),
+        bases=manifest["bases"],
+        spot_price=(manifest.get("spot_prices") or {}).get(base),
+        dvol_index=(manifest.get("dvol_indices") or {}).get(base),
+    )
+    return df, meta
+
+
+@pytest.fixture
+def data_root(tmp_path, monkeypatch):
+    """空的数据根目录，API 的目录索引指向它"""
+    root = tmp_path / "parquet"
+    root.mkdir()
+    monkeypatch.setattr(catalog, "DATA_ROOT", root)
+    # 请求形状统计决定预热内容，各用例从空统计开始，避免预热与用例的请求竞争
+    monkeypatch.setattr(response_cache, "_request_stats", response_cache.RequestStats(
+        response_cache.REQUEST_STATS_MAX_SHAPES, response_cache.REQUEST_STATS_HALF_LIFE_S,
+    ))
+    # 响应缓存以 asof_ts 为键，各用例的合成快照 asof 相同，需要隔离
+    clear_response_cache()
+    loader.clear_chain_cache()
+    clear_prepared_cache()
+    yield root
+    clear_response_cache()
@@ -0,0 +1,101 @@
+"""
+快照压缩：小时快照合并为 dt=YYYY-MM-DD（最后一个快照的完整链 + 反向增量），可逐小时还原，
+合并后的小时目录在宽限期之后才删除
+"""
+from __future__ import annotations
+
+import json
+
+import pandas as pd
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+import compact_snapshots
+from app.api import routes_spread
+from app.services.catalog import get_catalog
+from app.services.scanner import scan_buckets
+from conftest import ASOF_TS, SPOT_PRICES, read_full_chain, write_snapshot
+
+
+DAY = "2025-10-08"
+DAY_ASOF_TS = ASOF_TS - 24 * 3600 * 1000
+HOURS = [5, 6, 7]
+TODAY = "2025-10-10"
+
+
+@pytest.fixture
+def hourly_dirs(data_root):
+    return [
+        write_snapshot(
+            data_root, "consolidated", asof=DAY_ASOF_TS + (hour - 8) * 3600 * 1000, name=f"{DAY}-{hour:02d}", seed=hour,
+        )
+        for hour in HOURS
+    ]
+
+
+def _dump(result) -> str:
+    return json.dumps(jsonable_encoder(result), sort_keys=True)
+
+
+def _scan_requests():
+    for tenor in ("near", "mid", "far"):
+        for direction in ("up", "down"):
+            yield routes_spread.ScanRequest(base="BTC", date=DAY, direction=direction, tenor=tenor, return_per_bucket=5)
+
+
+def test_compacted_day_restores_every_snapshot(data_root, hourly_dirs):
+    compact_snapshots.compact(data_root, today=TODAY, grace_s=3600)
+    day_dir = data_root / f"dt={DAY}"
+    manifest = json.loads((day_dir / "manifest.json").read_text())
+    assert len(manifest["compacted"]["snapshots"]) == len(HOURS)
+    assert all((day_dir / f"base={base}" / "chain.arrow").exists() for base in SPOT_PRICES)
+
+    for base in SPOT_PRICES:
+        restored = compact_snapshots.restore_hourly(day_dir, base)
+        originals = {}
+        for d in hourly_dirs:
+            df, meta = read_full_chain(d, base)
+            originals[meta.asof_ts] = df
+        assert sorted(restored) == sorted(originals)
+        for asof, df in originals.items():
+            want = compact_snapshots._history_frame(df, asof).drop(columns="removed")
+            want = want.sort_values(["expiry_ts", "option_type", "strike"], kind="stable").reset_index(drop=True)
+            pd.testing.assert_frame_equal(restored[asof][want.columns].reset_index(drop=True), want)
+
+
+def test_folded_hourly_dirs_are_deleted_after_the_grace_period(data_root, hourly_dirs):
+    last_df, last_meta = read_full_chain(hourly_dirs[-1], "BTC")
+    want = [
+        _dump(scan_buckets(last_df, last_meta, tenor=req.tenor, direction=req.direction, return_per_bucket=5))
+        for req in _scan_requests()
+    ]
+
+    compact_snapshots.compact(data_root, today=TODAY, grace_s=3600)
+    # 宽限期内保留小时目录（正在进行的扫描可能仍在读取），目录索引已改用压缩目录
+    assert all(d.is_dir() for d in hourly_dirs)
+    assert get_catalog().snapshot_dir(DAY) == data_root / f"dt={DAY}"
+    assert [_dump(routes_spread._scan(req)) for req in _scan_requests()] == want
+
+    compact_snapshots.compact(data_root, today=TODAY, grace_s=0)
+    assert not any(d.exists() for d in hourly_dirs)
+    assert get_catalog().snapshot_dir(DAY) == data_root / f"dt={DAY}"
+    assert [_dump(routes_spread._scan(req)) for req in _scan_requests()] == want
+
+
+def test_late_hourly_snapshot_is_folded_into_the_existing_day(data_root, hourly_dirs):
+    compact_snapshots.compact(data_root, today=TODAY, grace_s=0)
+    late = write_snapshot(data_root, "consolidated", asof=DAY_ASOF_TS + 3600 * 1000, name=f"{DAY}-09", seed=9)
+    compact_snapshots.compact(data_root, today=TODAY, grace_s=3600)
+
+    day_dir = data_root / f"dt={DAY}"
+    manifest = json.loads((day_dir / "manifest.json").read_text())
+    assert len(manifest["compacted"]["snapshots"]) == len(HOURS) + 1
+    assert manifest["asof_ts"] == DAY_ASOF_TS + 3600 * 1000
+    assert len(compact_snapshots.restore_hourly(day_dir, "ETH")) == len(HOURS) + 1
+    assert late.is_dir()
+
+
+def test_days_past_retention_are_deleted(data_root):
+    old = write_snapshot(data_root, "consolidated", asof=ASOF_TS - 400 * 24 * 3600 * 1000, name="2024-09-04-08")
+    compact_snapshots.compact(data_root, today=TODAY, daily_months=6)
+    assert not old.exists()
@@ -0,0 +1,99 @@
+"""
+扫描调度：在途任务达到上限时 503 + Retry-After，超过截止时间 504，且在途计数覆盖到线程真正结束
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.api import dispatch
+from app.api.dispatch import SCAN_RETRY_AFTER_S, ScanDispatcher
+from app.main import create_app
+from conftest import DATE, write_snapshot
+
+
+SCAN_BODY = {"base": "BTC", "date": DATE, "direction": "up", "tenor": "near"}
+
+
+def _wait_until(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def dispatcher_factory():
+    created = []
+
+    def make(workers: int, queue_limit: int, deadline_s: float) -> ScanDispatcher:
+        d = ScanDispatcher(workers, queue_limit, deadline_s)
+        created.append(d)
+        return d
+
+    yield make
+    for d in created:
+        d.shutdown()
+
+
+def test_sheds_load_with_503_when_queue_is_full(dispatcher_factory):
+    d = dispatcher_factory(workers=1, queue_limit=2, deadline_s=5)
+    release = threading.Event()
+
+    async def scenario():
+        running = [asyncio.ensure_future(d.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert d.in_flight == 2
+        with pytest.raises(HTTPException) as exc:
+            await d.run(lambda: "never")
+        release.set()
+        return exc.value, await asyncio.gather(*running)
+
+    err, results = asyncio.run(scenario())
+    assert err.status_code == 503
+    assert err.headers == {"Retry-After": str(SCAN_RETRY_AFTER_S)}
+    assert results == [True, True]
+    _wait_until(lambda: d.in_flight == 0)
+
+
+def test_deadline_returns_504_and_counts_running_thread(dispatcher_factory):
+    d = dispatcher_factory(workers=1, queue_limit=4, deadline_s=0.1)
+    release = threading.Event()
+    queued_ran = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(d.run(release.wait))
+        queued = asyncio.ensure_future(d.run(queued_ran.set))
+        return await asyncio.gather(running, queued, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert [r.status_code for r in results] == [504, 504]
+    # 已开始执行的线程无法中断，结束前仍计入在途数；仍在排队的任务被取消，不会再执行
+    assert d.in_flight == 1
+    release.set()
+    _wait_until(lambda: d.in_flight == 0)
+    assert not queued_ran.is_set()
+
+
+def test_routes_surface_503_and_504(data_root, monkeypatch, dispatcher_factory):
+    write_snapshot(data_root, "consolidated")
+    with TestClient(create_app()) as client:
+        monkeypatch.setattr(dispatch, "_dispatcher", dispatcher_factory(workers=1, queue_limit=0, deadline_s=5))
+        r = client.post("/api/spread/scan", json=SCAN_BODY)
+        assert r.status_code == 503
+        assert r.headers["retry-after"] == str(SCAN_RETRY_AFTER_S)
+
+        monkeypatch.setattr(dispatch, "_dispatcher", dispatcher_factory(workers=1, queue_limit=4, deadline_s=0))
+        r = client.post("/api/spread/scan", json=SCAN_BODY)
+        assert r.status_code == 504
+
+        # 错误响应不进入响应缓存
+        monkeypatch.setattr(dispatch, "_dispatcher", dispatcher_factory(workers=1, queue_limit=4, deadline_s=5))
+        r = client.post("/api/spread/scan", json=SCAN_BODY)
+        assert r.status_code == 200
+        assert r.json()["base"] == "BTC"
@@ -0,0 +1,92 @@
+"""
+ETL 快照发布：总是发布到新目录并切换 LATEST 指针，从不替换读取方可能正在使用的目录
+"""
+from __future__ import annotations
+
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import etl_daily
+from app.services import loader
+from app.services.catalog import get_catalog
+from conftest import DATE, DTES, DVOL_INDICES, SPOT_PRICES, make_chain
+
+
+NOW = datetime(2025, 10, 9, 8, 53, 20, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def etl_root(data_root, monkeypatch):
+    monkeypatch.setattr(etl_daily, "DATA_ROOT", data_root)
+    return data_root
+
+
+def _save(now: datetime):
+    asof = int(now.timestamp() * 1000)
+    frames = {}
+    for seed, (base, spot) in enumerate(SPOT_PRICES.items()):
+        df = make_chain(base, spot, asof, DTES, seed=seed).drop(columns=["date", "asof_ts"])
+        df["_has_meta"] = True
+        frames[base] = df
+    return etl_daily.save_snapshot(now, DATE, list(SPOT_PRICES), frames, SPOT_PRICES, DVOL_INDICES)
+
+
+def _pointer(root):
+    return json.loads((root / etl_daily.LATEST_POINTER).read_text())
+
+
+def test_same_hour_rerun_publishes_a_new_directory(etl_root):
+    first = _save(NOW)
+    hourly = etl_root / "dt=2025-10-09-08"
+    assert first["timestamp"] == "2025-10-09-08"
+    assert _pointer(etl_root)["dir"] == hourly.name
+    inode = hourly.stat().st_ino
+
+    rerun = _save(NOW + timedelta(minutes=2))
+    assert rerun["timestamp"] == "2025-10-09-085520"
+    # 旧目录原样保留（正在读取它的请求不受影响），指针与目录索引切换到新快照
+    assert hourly.stat().st_ino == inode
+    assert json.loads((hourly / "manifest.json").read_text())["asof_ts"] == first["asof_ts"]
+    assert _pointer(etl_root) == {"dir": "dt=2025-10-09-085520", "date": DATE, "asof_ts": rerun["asof_ts"]}
+    assert get_catalog().snapshot_asof() == rerun["asof_ts"]
+    _, meta = loader.load_chain_for(DATE, "BTC")
+    assert meta.asof_ts == rerun["asof_ts"]
+    assert not list(etl_root.glob(".staging-*"))
+
+
+def test_older_snapshot_does_not_move_the_pointer_back(etl_root):
+    newer = _save(NOW)
+    older = _save(NOW - timedelta(hours=1))
+    assert (etl_root / f"dt={older['timestamp']}").is_dir()
+    assert _pointer(etl_root)["asof_ts"] == newer["asof_ts"]
+    assert get_catalog().snapshot_asof() == newer["asof_ts"]
+
+
+def test_existing_target_is_never_replaced(etl_root):
+    _save(NOW)
+    staging = etl_root / ".staging-test"
+    staging.mkdir()
+    with pytest.raises(FileExistsError):
+        etl_daily.publish_new_snapshot(staging, etl_root / "dt=2025-10-09-08", {"asof_ts": 0})
+    assert not staging.exists()
+    assert (etl_root / "dt=2025-10-09-08" / "manifest.json").exists()
+
+
+
+def test_arrow_copies_are_kept_for_the_newest_snapshots_only(etl_root, monkeypatch):
+    monkeypatch.setattr(etl_daily, "ETL_ARROW_KEEP", 2)
+    saved = [_save(NOW + timedelta(hours=h)) for h in range(4)]
+    snapshots = [etl_root / f"dt={m['timestamp']}" for m in saved]
+    assert [bool(list(d.glob("base=*/chain.arrow"))) for d in snapshots] == [False, False, True, True]
+    assert all((d / "base=BTC" / "chain.parquet").exists() for d in snapshots)
+
+
+def test_snapshot_without_arrow_copy_reads_parquet(etl_root, monkeypatch):
+    monkeypatch.setattr(etl_daily, "ETL_ARROW_KEEP", 0)
+    manifest = _save(NOW)
+    assert not list(etl_root.glob("dt=*/base=*/chain.arrow"))
+    chain, meta = loader.load_chain_for(DATE, "BTC")
+    assert meta.asof_ts == manifest["asof_ts"]
+    assert sorted(chain["expiry_ts"].unique()) == manifest["expiries"]["BTC"]
@@ -0,0 +1,110 @@
+"""
+分区裁剪回归：API 路由（按 DTE / 期权类型裁剪读取）与基线读取整条链后扫描的结果必须一致
+"""
+from __future__ import annotations
+
+import json
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+from app.api import routes_single_leg, routes_spread
+from app.services import loader
+from app.services.scanner import scan_buckets, scan_opinion_spreads
+from app.services.single_leg import scan_cc, scan_csp
+from conftest import DATE, LAYOUTS, NO_EARLY_DTES, SPOT_PRICES, read_full_chain, write_snapshot
+
+
+TARGETS = {"BTC": 65000.0, "ETH": 2800.0}
+
+
+def _dump(result) -> str:
+    return json.dumps(jsonable_encoder(result), sort_keys=True)
+
+
+def _cases(base: str, single_leg: bool = True):
+    """(请求, 路由函数, 对整条链调用扫描器的函数)；single_leg=False 时不含 CSP/CC"""
+    for tenor in ("near", "mid", "far"):
+        for direction in ("up", "down"):
+            for min_oi in (0, 200):
+                req = routes_spread.ScanRequest(
+                    base=base, date=DATE, direction=direction, tenor=tenor, return_per_bucket=5, min_oi=min_oi,
+                )
+                yield req, routes_spread._scan, lambda df, meta, req=req: scan_buckets(
+                    df, meta, tenor=req.tenor, direction=req.direction, return_per_bucket=req.return_per_bucket,
+                    min_oi=req.min_oi, max_width=req.max_width,
+                )
+    for horizon in ("short", "mid", "long"):
+        for view in ("up", "down", "not_up", "not_down"):
+            req = routes_spread.OpinionRequest(base=base, horizon=horizon, view=view, target_price=TARGETS[base])
+            yield req, routes_spread._opinion, lambda df, meta, req=req: scan_opinion_spreads(
+                df, meta, horizon=req.horizon, view=req.view, target_price=req.target_price,
+                max_gap_steps=req.max_gap_steps, return_count=req.return_per_bucket,
+            )
+    if not single_leg:
+        return
+    for max_dte in (1, 7, 30, 60, 180):
+        req = routes_single_leg.CSPRequest(base=base, max_dte=max_dte, min_oi=0)
+        yield req, routes_single_leg._scan_csp_strategy, lambda df, meta, req=req: scan_csp(
+            df, meta, max_dte=req.max_dte, max_delta=req.max_delta, min_oi=req.min_oi,
+            max_spread_bps=req.max_spread_bps, available_cash=req.available_cash, return_count=req.return_count,
+        )
+        req = routes_single_leg.CCRequest(base=base, max_dte=max_dte, min_oi=0)
+        yield req, routes_single_leg._scan_cc_strategy, lambda df, meta, req=req: scan_cc(
+            df, meta, max_dte=req.max_dte, max_delta=req.max_delta, min_oi=req.min_oi,
+            max_spread_bps=req.max_spread_bps, position_size=req.position_size, return_count=req.return_count,
+        )
+
+
+def _assert_matches_full_chain(snap, base: str, single_leg: bool = True) -> int:
+    full_df, full_meta = read_full_chain(snap, base)
+    compared = 0
+    for req, route, scan_full in _cases(base, single_leg):
+        got = _dump(route(req))
+        want = _dump(scan_full(full_df, full_meta))
+        assert got == want, f"{route.__name__} {req!r}"
+        compared += 1
+    return compared
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_pruned_reads_match_full_chain(data_root, layout):
+    snap = write_snapshot(data_root, layout)
+    for base in SPOT_PRICES:
+        assert _assert_matches_full_chain(snap, base) > 0
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_empty_after_pruning_keeps_base_and_spot(data_root, layout):
+    # 没有 7 天内到期的合约：max_dte=7 的 CSP/CC 裁剪后链为空
+    snap = write_snapshot(data_root, layout, dtes=NO_EARLY_DTES)
+    for base, spot in SPOT_PRICES.items():
+        chain, meta = loader.load_chain_for(DATE, base, dte_range=(0, 7), option_type="P")
+        assert chain.empty
+        assert meta.base == base
+
+        csp = routes_single_leg._scan_csp_strategy(routes_single_leg.CSPRequest(base=base, max_dte=7))
+        cc = routes_single_leg._scan_cc_strategy(routes_single_leg.CCRequest(base=base, max_dte=7))
+        for result in (csp, cc):
+            assert result["base"] == base
+            assert result["spot_price"] == spot
+            assert result["candidates"] == []
+        _assert_matches_full_chain(snap, base)
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_spot_fallback_uses_unpruned_chain(data_root, layout):
+    # manifest 没有现货价：回退值是整条链 underlying 的中位数，不随裁剪变化
+    snap = write_snapshot(data_root, layout, spot_prices=None)
+    for base in SPOT_PRICES:
+        full_df, _ = read_full_chain(snap, base)
+        median = float(full_df["underlying"].dropna().median())
+
+        _, meta = loader.load_chain_for(DATE, base, dte_range=(0, 7), option_type="C")
+        assert meta.spot_price is None
+        assert meta.spot_fallback == pytest.approx(median, rel=1e-12)
+
+        scan = routes_spread._scan(routes_spread.ScanRequest(base=base, date=DATE, direction="up", tenor="near"))
+        assert scan["spot_price"] == pytest.approx(median, rel=1e-12)
+        # CSP/CC 的 delta 估算需要 manifest 现货价（与基线一致），这里只比较价差扫描
+        _assert_matches_full_chain(snap, base, single_leg=False)
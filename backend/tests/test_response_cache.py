@@ -0,0 +1,125 @@
+"""
+响应缓存：ETag / If-None-Match 304、Cache-Control，以及快照切换时不缓存、不给 ETag
+"""
+from __future__ import annotations
+
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import response_cache, routes_spread
+from app.api.response_cache import RESPONSE_STALE_MAX_AGE_S, SNAPSHOT_INTERVAL_S, max_age_for
+from app.main import create_app
+from conftest import ASOF_TS, DATE, write_snapshot
+
+
+SCAN_BODY = {"base": "BTC", "date": DATE, "direction": "up", "tenor": "near"}
+NEXT_ASOF_TS = ASOF_TS + 3600 * 1000
+
+
+@pytest.fixture
+def scan_calls(monkeypatch):
+    """统计 /spread/scan 实际执行扫描的次数"""
+    calls = []
+    original = routes_spread._scan
+
+    def counting(req):
+        calls.append(req)
+        return original(req)
+
+    monkeypatch.setattr(routes_spread, "_scan", counting)
+    return calls
+
+
+@pytest.fixture
+def client(data_root):
+    write_snapshot(data_root, "consolidated")
+    with TestClient(create_app()) as client:
+        _wait_ready(client)
+        yield client
+
+
+def _wait_ready(client: TestClient, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while client.get("/api/ready").status_code != 200:
+        assert time.monotonic() < deadline, "warm-up did not finish"
+        time.sleep(0.02)
+
+
+def test_if_none_match_returns_304_without_scanning(client, scan_calls):
+    r = client.post("/api/spread/scan", json=SCAN_BODY)
+    assert r.status_code == 200
+    etag = r.headers["etag"]
+    assert etag.startswith(f'"{ASOF_TS}-')
+    assert r.headers["cache-control"].startswith("public, max-age=")
+    assert len(scan_calls) == 1
+
+    for header in (etag, f"W/{etag}", f'"other", {etag}'):
+        r304 = client.post("/api/spread/scan", json=SCAN_BODY, headers={"If-None-Match": header})
+        assert r304.status_code == 304
+        assert r304.content == b""
+        assert r304.headers["etag"] == etag
+    assert len(scan_calls) == 1
+
+    # 不带条件头的重复请求由响应缓存提供
+    again = client.post("/api/spread/scan", json=SCAN_BODY)
+    assert again.status_code == 200
+    assert again.content == r.content
+    assert again.headers["etag"] == etag
+    assert len(scan_calls) == 1
+
+
+def test_non_matching_or_wildcard_if_none_match_returns_body(client):
+    etag = client.post("/api/spread/scan", json=SCAN_BODY).headers["etag"]
+
+    other = client.post("/api/spread/scan", json={**SCAN_BODY, "direction": "down"}, headers={"If-None-Match": etag})
+    assert other.status_code == 200
+    assert other.headers["etag"] != etag
+
+    # 只读 POST 不处理 If-None-Match: *
+    wildcard = client.post("/api/spread/scan", json=SCAN_BODY, headers={"If-None-Match": "*"})
+    assert wildcard.status_code == 200
+    assert wildcard.json()["base"] == "BTC"
+
+
+def test_new_snapshot_invalidates_etag(client, data_root, scan_calls):
+    etag = client.post("/api/spread/scan", json=SCAN_BODY).headers["etag"]
+    write_snapshot(data_root, "consolidated", asof=NEXT_ASOF_TS)
+
+    r = client.post("/api/spread/scan", json=SCAN_BODY, headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.headers["etag"].startswith(f'"{NEXT_ASOF_TS}-')
+    assert r.json()["asof_ts"] == NEXT_ASOF_TS
+    assert len(scan_calls) == 2
+
+
+def test_snapshot_published_mid_scan_is_not_cached(client, data_root, monkeypatch):
+    original = routes_spread._scan
+    published = []
+
+    def publish_then_scan(req):
+        if not published:
+            published.append(write_snapshot(data_root, "consolidated", asof=NEXT_ASOF_TS))
+        return original(req)
+
+    monkeypatch.setattr(routes_spread, "_scan", publish_then_scan)
+    r = client.post("/api/spread/scan", json=SCAN_BODY)
+    assert r.status_code == 200
+    assert r.headers["cache-control"] == "no-cache"
+    assert "etag" not in r.headers
+    params = routes_spread.ScanRequest(**SCAN_BODY).json(sort_keys=True)
+    assert response_cache._response_cache.get(("spread/scan", params, ASOF_TS)) is None
+
+    r = client.post("/api/spread/scan", json=SCAN_BODY)
+    assert r.headers["etag"].startswith(f'"{NEXT_ASOF_TS}-')
+
+
+def test_max_age_tracks_next_snapshot_slot():
+    slot = 1_760_000_400  # 整点（SNAPSHOT_OFFSET_S=0 时）
+    slot -= slot % SNAPSHOT_INTERVAL_S
+    now = slot + 600
+    assert max_age_for((slot + 60) * 1000, historical=False, now=now) == SNAPSHOT_INTERVAL_S - 600
+    # 当前时间槽的快照还没落地：只给短 max-age
+    assert max_age_for((slot - 60) * 1000, historical=False, now=now) == RESPONSE_STALE_MAX_AGE_S
+    assert max_age_for((slot - 60) * 1000, historical=True, now=now) == SNAPSHOT_INTERVAL_S
@@ -0,0 +1,83 @@
+"""
+请求合并：相同的在途扫描只计算一次，结果 / 异常与阶段耗时分发给所有等待者
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+
+import httpx
+
+from app.api import routes_spread
+from app.api.dispatch import SingleFlight
+from app.main import create_app
+from conftest import DATE, write_snapshot
+
+
+SCAN_BODY = {"base": "BTC", "date": DATE, "direction": "up", "tenor": "near"}
+
+
+def test_waiters_share_one_computation():
+    flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.do("key", compute) for _ in range(3)))
+        return results, len(flight)
+
+    results, pending = asyncio.run(scenario())
+    assert results == ["result"] * 3
+    assert calls == [1]
+    assert pending == 0
+
+
+def test_waiters_share_the_exception_and_survive_cancellation():
+    flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise ValueError("boom")
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.do("key", failing))
+        second = asyncio.ensure_future(flight.do("key", failing))
+        await asyncio.sleep(0)
+        # 一个等待者被取消不影响共享任务与其他等待者
+        first.cancel()
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    first, second = asyncio.run(scenario())
+    assert isinstance(first, asyncio.CancelledError)
+    assert isinstance(second, ValueError)
+
+
+def test_coalesced_requests_report_shared_stages(data_root, monkeypatch):
+    write_snapshot(data_root, "consolidated")
+    calls = []
+    original = routes_spread._scan
+
+    def slow_scan(req):
+        calls.append(req)
+        time.sleep(0.3)
+        return original(req)
+
+    monkeypatch.setattr(routes_spread, "_scan", slow_scan)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=create_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(client.post("/api/spread/scan", json=SCAN_BODY) for _ in range(3)))
+
+    responses = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert [r.status_code for r in responses] == [200] * 3
+    assert len({r.content for r in responses}) == 1
+    timings = [r.headers["server-timing"] for r in responses]
+    # 每个响应都带有共享计算的阶段耗时，后加入者另带等待时间
+    assert all("load;dur=" in t for t in timings)
+    assert sum("coalesced;dur=" in t for t in timings) == 2
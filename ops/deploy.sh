@@ -19,6 +19,11 @@ docker compose exec -T backend python /app/scripts/etl_daily.py --date "$DATE_UT
 echo "[Deploy] Warm up API..."
 sleep 2
 curl -fsS http://127.0.0.1:3115/api/health || true
+# /api/ready 在 worker 预加载最新快照并预计算默认扫描后才返回 200
+for _ in $(seq 1 60); do
+  curl -fsS http://127.0.0.1:3115/api/ready >/dev/null 2>&1 && break
+  sleep 1
+done
 curl -fsS http://127.0.0.1:3115/api/meta/dates || true
 
 echo "[Deploy] Configure PM2 schedule (Asia/Shanghai 16:05 daily)"